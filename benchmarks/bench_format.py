@@ -0,0 +1,46 @@
+""" Compares the build time of a small report with and without a precompiled
+preamble format (see `pyreporter.make_format`). Requires pdflatex and the
+mylatexformat package.
+
+    python benchmarks/bench_format.py [repetitions]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import pyreporter
+
+
+def build_once(working_dir, format_dir):
+    pdf = pyreporter.Report('bench', working_dir, title='Format benchmark')
+    pdf.format_dir = format_dir
+    pdf.add_section('Results')
+    pdf.add_text('Lorem ipsum dolor sit amet.')
+    pdf.add_equation(r'x = \sum_{i=1}^n y_i')
+    pdf.add_table([['1', '2'], ['3', '4']], header=['a', 'b'])
+    pdf.close()
+    return pdf.build(force=True)
+
+
+def main(repetitions=10):
+    working_dir = tempfile.mkdtemp(prefix='pyreporter-bench-')
+    format_dir = tempfile.mkdtemp(prefix='pyreporter-fmt-')
+    # create the format outside of the measurement
+    build_once(working_dir, format_dir)
+    for label, fdir in [('without format', None), ('with format', format_dir)]:
+        times = list()
+        for _ in range(repetitions):
+            result = build_once(working_dir, fdir)
+            assert result['status'] == 'ok', result['output']
+            times.append(result['time'])
+        print('{:>15}: {:.3f}s per build (min {:.3f}s, {} builds)'.format(
+            label, sum(times)/len(times), min(times), repetitions))
+
+
+if __name__ == '__main__':
+    start = time.time()
+    main(*[int(a) for a in sys.argv[1:]])
+    print('total: {:.1f}s'.format(time.time() - start))
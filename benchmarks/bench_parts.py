@@ -0,0 +1,77 @@
+""" Compares the wall clock time of building a large report as one document
+and split into parts that are built in parallel (see
+`pyreporter.Report.build_parts`).
+
+    python benchmarks/bench_parts.py [--fake] [--sections N] [parts ...]
+
+With --fake, the fake latex engine is used (slowed down to about the speed
+of pdflatex) and the parts are merged by concatenation, otherwise pdflatex
+and `pyreporter.merge_pdfs`, which needs pypdf, pdfunite or qpdf.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import pyreporter
+
+
+def concatenate(paths, output):
+    with open(output, 'wb') as f:
+        for path in paths:
+            with open(path, 'rb') as part:
+                f.write(part.read())
+
+
+def build_once(working_dir, sections, parts, fake):
+    pdf = pyreporter.Report('bench', working_dir, title='Parts benchmark')
+    pdf.parts = parts
+    if fake:
+        pdf.latex_command = pyreporter.fake_engine_command()
+        pdf.pdf_merger = concatenate
+    for i in range(sections):
+        pdf.add_section('Section {}'.format(i))
+        for j in range(10):
+            pdf.add_text('Lorem ipsum dolor sit amet, consetetur sadipscing '
+                'elitr, sed diam nonumy eirmod tempor invidunt ut labore. ' * 8)
+            pdf.add_equation(r'x_{} = \sum_i y_i^{}'.format(j, i))
+        pdf.add_table([[str(k), str(k*k)] for k in range(40)],
+                header=['k', 'k^2'])
+    result = pdf.close(build=True)
+    assert result['status'] == 'ok', result
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('parts', type=int, nargs='*', default=[1, 2, 4, 8])
+    parser.add_argument('--sections', type=int, default=200)
+    parser.add_argument('--fake', action='store_true')
+    args = parser.parse_args()
+    if args.fake:
+        os.environ.setdefault('FAKE_ENGINE_DELAY', '2')
+    for parts in [None] + args.parts:
+        working_dir = tempfile.mkdtemp(prefix='pyreporter-bench-')
+        t = time.time()
+        result = build_once(working_dir, args.sections, parts, args.fake)
+        first = time.time() - t
+        # a second build with unchanged content but fresh latex runs shows
+        # the time once the part numbers are known
+        for name in os.listdir(working_dir):
+            if name.endswith('.fingerprint'):
+                os.remove(os.path.join(working_dir, name))
+        t = time.time()
+        build_once(working_dir, args.sections, parts, args.fake)
+        again = time.time() - t
+        print('{:>8} parts: {:.2f}s first build ({} rounds), {:.2f}s '
+            'rebuild'.format(parts or 'no', first, result.get('rounds', 1),
+                again))
+        shutil.rmtree(working_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+""" Compares the time it takes to write the same report layout for many
+parameter sets, built element by element for every report and rendered from
+a `pyreporter.Skeleton`.
+
+    python benchmarks/bench_skeleton.py [--reports N] [--sections N]
+
+Only the tex files are written, no figures and no latex builds.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import pyreporter
+
+TEXT = 'Lorem ipsum dolor sit amet, consetetur sadipscing elitr. ' * 8
+STATIC = [[str(k), str(k*k)] for k in range(40)]
+
+
+def values(params):
+    return [[str(k), str(k*params['scale'])] for k in range(10)]
+
+
+def title(params):
+    return 'Report {}'.format(params['scale'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reports', type=int, default=200)
+    parser.add_argument('--sections', type=int, default=20)
+    args = parser.parse_args()
+    instances = [dict(scale=i) for i in range(args.reports)]
+    working_dir = tempfile.mkdtemp(prefix='pyreporter-bench-')
+
+    t = time.time()
+    for i, params in enumerate(instances):
+        pdf = pyreporter.Report('report', os.path.join(working_dir,
+            'script', str(i)), title='Report {}'.format(i))
+        for j in range(args.sections):
+            pdf.add_section('Section {}'.format(j))
+            for k in range(5):
+                pdf.add_text(TEXT)
+                pdf.add_equation(r'x_{} = \sum_i y_i^{}'.format(k, j))
+            pdf.add_table(STATIC, header=['k', 'k^2'])
+            pdf.add_table(values(params), header=['k', 'v'])
+        pdf.close()
+    script = time.time() - t
+
+    t = time.time()
+    skeleton = pyreporter.Skeleton(title=title)
+    for j in range(args.sections):
+        skeleton.add_section('Section {}'.format(j))
+        for k in range(5):
+            skeleton.add_text(TEXT)
+            skeleton.add_equation(r'x_{} = \sum_i y_i^{}'.format(k, j))
+        skeleton.add_table(STATIC, header=['k', 'k^2'])
+        skeleton.add_table_slot(values, header=['k', 'v'])
+    for i, params in enumerate(instances):
+        skeleton.report(params, 'report', os.path.join(working_dir,
+            'skeleton', str(i))).close()
+    rendered = time.time() - t
+
+    print('{} reports: {:.2f} ms per report built by script, {:.2f} ms '
+        'rendered from a skeleton'.format(args.reports,
+            script / args.reports * 1e3, rendered / args.reports * 1e3))
+    shutil.rmtree(working_dir)
+
+
+if __name__ == '__main__':
+    main()
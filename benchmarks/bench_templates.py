@@ -0,0 +1,42 @@
+""" Compares the cost per element of the template functions with the compiled
+templates (see `pyreporter.StandardTemplate.compiled`) to the cost when they
+are built for every element, as they were before.
+
+    python benchmarks/bench_templates.py [number]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import pyreporter
+
+ELEMENTS = [
+    ('section', lambda: pyreporter.make_section('A section', starred=True)),
+    ('figure', lambda: pyreporter.make_figure('width', '10cm', 'fig.pdf',
+        caption='A figure')),
+    ('float figure', lambda: pyreporter.make_figure('width', '10cm', 'fig.pdf',
+        caption='A figure', float=True)),
+    ('table', lambda: pyreporter.make_table([['1', '2'], ['3', '4']],
+        header=['a', 'b'], caption='A table')),
+]
+
+
+def uncompiled(f):
+    def run():
+        pyreporter.Template.clear_compiled()
+        return f()
+    return run
+
+
+def main(number=20000):
+    for name, f in ELEMENTS:
+        before = min(timeit.repeat(uncompiled(f), number=number, repeat=5))
+        after = min(timeit.repeat(f, number=number, repeat=5))
+        print('{:>15}: {:.2f}us -> {:.2f}us per element ({:.1f}x)'.format(
+            name, before/number*1e6, after/number*1e6, before/after))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
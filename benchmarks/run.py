@@ -0,0 +1,216 @@
+""" Benchmark suite for pyreporter.
+
+Times Length handling, template rendering, tables, plotting and a full
+report round trip (with a fake latex engine, see
+`pyreporter.fake_engine_command`) and writes the results to a json file,
+which can be compared to the results of an earlier run:
+
+    python benchmarks/run.py -o new.json [-k filter] [--compare old.json]
+
+Plotting benchmarks are skipped if matplotlib is not installed.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+import pyreporter
+
+BENCHMARKS = list()
+
+
+def benchmark(name, number=1, repeat=5):
+    """ Registers a benchmark. The decorated function does the setup and
+    returns the callable that is timed.
+    """
+    def register(f):
+        BENCHMARKS.append((name, number, repeat, f))
+        return f
+    return register
+
+
+@benchmark('length.construct_from_string', number=10000)
+def _():
+    return lambda: pyreporter.Length('2.5cm')
+
+
+@benchmark('length.construct_from_value', number=10000)
+def _():
+    return lambda: pyreporter.Length(2.5, 'in')
+
+
+@benchmark('length.get_value_in', number=10000)
+def _():
+    l = pyreporter.Length('2.5cm')
+    return lambda: l.get_value_in('pt')
+
+
+@benchmark('length.eq', number=10000)
+def _():
+    a, b = pyreporter.Length('2.54cm'), pyreporter.Length(1, 'in')
+    return lambda: a == b
+
+
+@benchmark('length.convert_array', number=1000)
+def _():
+    import numpy as np
+    values = np.linspace(0, 30, 1000)
+    return lambda: pyreporter.convert_lengths(values, 'cm', 'pt')
+
+
+@benchmark('template.section', number=10000)
+def _():
+    return lambda: pyreporter.make_section('A section', starred=True)
+
+
+@benchmark('template.figure', number=10000)
+def _():
+    return lambda: pyreporter.make_figure('width', '10cm', 'fig.pdf',
+            caption='A figure')
+
+
+@benchmark('template.table', number=1000)
+def _():
+    data = [['1', '2', '3'], ['4', '5', '6']]
+    return lambda: pyreporter.make_table(data, header=['a', 'b', 'c'],
+            caption='A table')
+
+
+def _table_benchmark(rows):
+    @benchmark('make_table.list.{}rows'.format(rows),
+            number=max(1, 1000 // rows))
+    def _():
+        data = [[str(i), str(i*0.5), 'text'] for i in range(rows)]
+        return lambda: pyreporter.make_table(data)
+
+    @benchmark('make_table.numpy.{}rows'.format(rows),
+            number=max(1, 1000 // rows))
+    def _():
+        import numpy as np
+        data = np.random.RandomState(0).rand(rows, 3)
+        return lambda: pyreporter.make_table(data, formats='%.3f')
+
+for _rows in [10, 1000, 100000]:
+    _table_benchmark(_rows)
+
+
+def _plot_benchmark(kind, points):
+    @benchmark('make_plot.{}'.format(kind), repeat=3)
+    def _():
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import numpy as np
+        directory = tempfile.mkdtemp(prefix='pyreporter-bench-')
+        report = pyreporter.Report('bench', directory)
+
+        def generator():
+            fig = plt.figure(figsize=(8, 3))
+            x = np.linspace(0, 10, points)
+            plt.plot(x, np.sin(x))
+            return fig
+
+        def run():
+            report.make_plot(generator, widthratio=0.8, name='plot',
+                    force=True)
+            plt.close('all')
+        return run
+
+_plot_benchmark('trivial', 100)
+_plot_benchmark('heavy', 1000000)
+
+
+@benchmark('report.round_trip', repeat=5)
+def _():
+    directory = tempfile.mkdtemp(prefix='pyreporter-bench-')
+    engine = pyreporter.fake_engine_command()
+
+    def run():
+        report = pyreporter.Report('bench', directory, title='Benchmark')
+        report.latex_command = engine
+        for i in range(20):
+            report.add_section('Section {}'.format(i))
+            report.add_text('Lorem ipsum dolor sit amet.')
+            report.add_equation(r'x_{} = \sum_i y_i'.format(i))
+            report.add_table([[str(j), str(j*j)] for j in range(50)],
+                    header=['j', 'j^2'])
+        result = report.close(build=True)
+        assert result['status'] == 'ok', result['output']
+        shutil.rmtree(directory)
+    return run
+
+
+def run(pattern=None):
+    results = dict()
+    for name, number, repeat, setup in BENCHMARKS:
+        if pattern is not None and pattern not in name:
+            continue
+        try:
+            f = setup()
+        except ImportError as e:
+            print('{:<40} skipped ({})'.format(name, e))
+            continue
+        times = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                f()
+            times.append((time.perf_counter() - start) / number)
+        times.sort()
+        results[name] = dict(min=times[0], median=times[len(times) // 2],
+                number=number, repeat=repeat)
+        print('{:<40} {:>12.3f} us (min {:.3f} us)'.format(name,
+            results[name]['median']*1e6, results[name]['min']*1e6))
+    return results
+
+
+def compare(results, old, tolerance):
+    """ Prints the ratio of the medians for all benchmarks in both runs and
+    returns the names of those that got slower by more than tolerance.
+    """
+    slower = list()
+    for name in sorted(results):
+        if name not in old:
+            continue
+        ratio = results[name]['median'] / old[name]['median']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  <-- slower'
+            slower.append(name)
+        print('{:<40} {:>6.2f}x{}'.format(name, ratio, flag))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='json file for the results')
+    parser.add_argument('-k', dest='pattern',
+            help='only run benchmarks whose name contains this')
+    parser.add_argument('--compare', help='json file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+            help='relative slow down that counts as regression')
+    args = parser.parse_args()
+
+    results = run(args.pattern)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(date=datetime.datetime.now().isoformat(),
+                python=platform.python_version(),
+                platform=platform.platform(), results=results), f, indent=1,
+                sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+        if compare(results, old, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -49,7 +49,6 @@ pdf.add_plot(fig=myplotgenerator, widthratio=0.4, name='plot2')
 pdf.add_subsection('Table with awesome results')
 header = [pyreporter.bold(r) for r in['value1','value2','value3']]
 data = np.random.randint(0,10,(4,3))
-data = [[str(y) for y in x] for x in data]
 pdf.add_table(data, header=header, cols='lcr', caption='a very nice table')
 
 pdf.close(build=True)
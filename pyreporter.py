@@ -4,6 +4,16 @@ import string
 import datetime
 import random as rnd
 import os
+import json
+import hashlib
+import re
+import time
+import subprocess
+import itertools
+import functools
+import io
+import sys
+import contextlib
 
 
 rcParams = {'text.usetex' : True,
@@ -57,92 +67,260 @@ def almost_equal(a,b, tol=1e-8):
     """Helper function to compare floats"""
     return abs(a-b) <= (abs(a)+abs(b))/2. * tol
 
+# inches are the base unit of all conversions, 'pt' depends on the dpi
+_per_inch = {'cm': 2.54, 'mm': 25.4, 'm': 0.0254, 'in': 1.}
+_conversions = dict(((a, b), _per_inch[b]/_per_inch[a])
+        for a in _per_inch for b in _per_inch)
+_units = frozenset(['pt']) | frozenset(_per_inch)
+
+def _conversion_factor(unit, to, dpi):
+    """ Returns the factor that converts values in unit to values in the unit
+    to
+    """
+    factor = _conversions.get((unit, to))
+    if factor is not None:
+        return factor
+    if unit not in _units or to not in _units:
+        raise Exception('Unknown length unit: {}'.format(
+            unit if unit not in _units else to))
+    a = dpi if unit == 'pt' else _per_inch[unit]
+    b = dpi if to == 'pt' else _per_inch[to]
+    return b/a
+
+@functools.lru_cache(maxsize=1024)
+def _parse_length(s):
+    s = s.strip(' ')
+    sv = s.rstrip(string.ascii_letters).strip(' ')
+    su = s[len(sv):].strip(' ')
+    if su not in _units:
+        raise Exception('Unknown length unit: {}'.format(su))
+    return float(sv), su
+
+def convert_lengths(values, unit, to, dpi=72.):
+    """ Converts an array of values in unit to the unit to at once, e.g. for
+    layout computations. Returns a numpy array.
+    """
+    import numpy as np
+    return _conversion_factor(unit, to, dpi) * np.asarray(values, dtype=float)
+
 class Length(object):
     """ A class to handle lengths in a certain unit and convertions thereof. It
     supports 'm', 'cm', 'mm' and 'in'. Trough the attribute 'dpi' it also
-    converts to and from 'pt'.
+    converts to and from 'pt'. Lengths are immutable, operations return new
+    lengths.
     """
-    def __init__(self, *args, **kwargs):
-        self.dpi = kwargs.get('dpi', 72.)
-        if len(args) == 1:
+    __slots__ = ('value', 'unit', 'dpi')
+
+    def __init__(self, *args, dpi=72.):
+        if len(args) == 2:
+            value, unit = float(args[0]), args[1]
+            if unit not in _units:
+                self._valid_unit(unit)
+        elif len(args) == 1:
             if type(args[0]) == str:
-                self.from_string(args[0])
+                value, unit = _parse_length(args[0])
             else:
-                self.value = float(args[0])
-                self.unit = 'cm'
-        elif len(args) == 2:
-            self.value = float(args[0])
-            self._valid_unit(args[1])
-            self.unit = args[1]
+                value, unit = float(args[0]), 'cm'
         else:
             raise Exception('Length takes 1 or 2 arguments')
-    
+        _set_value(self, value)
+        _set_unit(self, unit)
+        _set_dpi(self, dpi)
+
+    @classmethod
+    def _make(cls, value, unit, dpi):
+        # skips the checks of __init__ for values that are known to be valid
+        self = object.__new__(cls)
+        _set_value(self, value)
+        _set_unit(self, unit)
+        _set_dpi(self, dpi)
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Length is immutable')
+
+    def __reduce__(self):
+        return (Length._make, (self.value, self.unit, self.dpi))
+
     def _valid_unit(self, u):
-        if u not in ['pt','in', 'cm', 'mm', 'm']:
-            raise Exception('Unknown length unit: {}'.format(su))
+        if u not in _units:
+            raise Exception('Unknown length unit: {}'.format(u))
+
+    @classmethod
+    def from_string(cls, s, dpi=72.):
+        """ Returns a new length from a string. Valid strings start with a
+        value and are followed by a known unit
+        """
+        return cls._make(*_parse_length(s) + (dpi,))
 
-    def from_string(self, s):
-        """ Assigns the value and unit from a string. Valid strings start with
-        a value and are followed by a known unit
+    def with_dpi(self, dpi):
+        """ Returns the same length with a different dpi
         """
-        s = s.strip(' ')
-        sv = s.rstrip(string.ascii_letters).strip(' ')
-        su = s[len(sv):].strip(' ')
-        self._valid_unit(su)
-        self.value = float(sv)
-        self.unit = su
+        return Length._make(self.value, self.unit, dpi)
 
     def convert_to(self, u):
         """Convert to the unit specified in by u.
         """
-        v = self.get_value_in(u)
-        return Length(v,u)
+        return Length._make(self.get_value_in(u), u, 72.)
 
     def get_value_in(self, u):
         """Return the value of self in the unit u as a float
         """
-        self._valid_unit(u)
-        conversions = {'pt': self.dpi, 'cm': 2.54, 'mm': 25.4, 'm':
-                0.0254, 'in': 1.}
-        # convert to inch and then to desired unit
-        return conversions[u]/conversions[self.unit]*self.value
+        return _conversion_factor(self.unit, u, self.dpi)*self.value
 
     def __eq__(self,other):
         if (type(other)==Length):
-            a = self.convert_to('in')
-            b = other.convert_to('in')
-            return almost_equal(a.value, b.value) 
+            return almost_equal(self.get_value_in('in'),
+                    other.get_value_in('in'))
         else:
             msg = "Unsupported operand type(s) for ==: '{}' and '{}'"
             raise TypeError(msg.format('Length', str(type(other))))
 
+    __hash__ = None
+
     def __mul__(self, other):
-        if (type(other)==int or type(other)==float):
-            return Length(self.value*other, self.unit)
+        if isinstance(other, (int, float)):
+            return Length._make(self.value*other, self.unit, 72.)
         else:
             msg = "Unsupported operand type(s) for *: '{}' and '{}'"
             raise TypeError(msg.format('Length', str(type(other))))
 
     def __rmul__(self, other):
-        if (type(other)==int or type(other)==float):
-            return Length(self.value*other, self.unit)
+        if isinstance(other, (int, float)):
+            return Length._make(self.value*other, self.unit, 72.)
         else:
             msg = "Unsupported operand type(s) for *: '{}' and '{}'"
             raise TypeError(msg.format(str(type(other)), 'Length'))
 
-    def __div__(self, other):
-        if (type(other)==int or type(other)==float):
-            return Length(self.value/other, self.unit)
+    def __truediv__(self, other):
+        if isinstance(other, (int, float)):
+            return Length._make(self.value/other, self.unit, 72.)
         else:
             msg = "Unsupported operand type(s) for /: '{}' and '{}'"
             raise TypeError(msg.format('Length', str(type(other))))
 
+    __div__ = __truediv__
+
     def __repr__(self):
         return '{}{}'.format(self.value, self.unit)
 
+# the slots are written through their descriptors, since Length.__setattr__
+# refuses to
+_set_value = Length.value.__set__
+_set_unit = Length.unit.__set__
+_set_dpi = Length.dpi.__set__
+
+
+class PageGeometry(object):
+    """ The paper and text area of a page, computed once from the paper size,
+    the orientation and the margins. The sizes are stored in pt.
+
+    Paper sizes that are not in papersizes_wh_cm can still be used by latex,
+    only their sizes are unknown: accessing them raises an exception.
+    """
+    def __init__(self, pagesize='a4paper', orientation='portrait',
+            left='2cm', right='2cm', top='2cm', bottom='2cm'):
+        if orientation not in ('portrait', 'landscape'):
+            raise Exception('Unknown page orientation: %s' % orientation)
+        self.pagesize = pagesize
+        self.orientation = orientation
+        self.left, self.right = Length(left), Length(right)
+        self.top, self.bottom = Length(top), Length(bottom)
+        self._sizes = None
+
+    def _size(self, i):
+        if self._sizes is None:
+            if self.pagesize not in papersizes_wh_cm:
+                raise Exception('Unknown paper size: %s' % self.pagesize)
+            width, height = papersizes_wh_cm[self.pagesize]
+            if self.orientation == 'landscape':
+                width, height = height, width
+            paperwidth = Length(width, 'cm').convert_to('pt')
+            paperheight = Length(height, 'cm').convert_to('pt')
+            self._sizes = (paperwidth, paperheight,
+                Length(paperwidth.value - self.left.get_value_in('pt') -
+                    self.right.get_value_in('pt'), 'pt'),
+                Length(paperheight.value - self.top.get_value_in('pt') -
+                    self.bottom.get_value_in('pt'), 'pt'))
+        return self._sizes[i]
+
+    paperwidth = property(lambda self: self._size(0))
+    paperheight = property(lambda self: self._size(1))
+    textwidth = property(lambda self: self._size(2))
+    textheight = property(lambda self: self._size(3))
+
+    def textwidth_in(self, u):
+        """ The width of the text area in the unit u
+        """
+        return self.textwidth.get_value_in(u)
+
+    def textheight_in(self, u):
+        """ The height of the text area in the unit u
+        """
+        return self.textheight.get_value_in(u)
+
+    def __repr__(self):
+        if self.pagesize not in papersizes_wh_cm:
+            return 'PageGeometry({}, {})'.format(self.pagesize,
+                    self.orientation)
+        return 'PageGeometry({}, {}, text {} x {})'.format(self.pagesize,
+                self.orientation, self.textwidth, self.textheight)
+
 
 
 
+def table_columns(data, formats=None):
+    """ Converts the columns of a table to lists of strings.
+
+    Parameters
+    ----------
+    data: list, numpy.ndarray or pandas.DataFrame
+        Either a list of rows, a 2D array or a DataFrame
+    formats: str, callable or list thereof, optional
+        Format specifications for the columns, either for all of them or one
+        per column. Strings containing '{' are used with str.format, all other
+        strings with the %-operator (e.g. '%.2f'). None means str. The
+        conversion is done column-wise in bulk. Default: None
+
+    Returns
+    -------
+    columns: list
+        A list of lists of strings, one per column
+    """
+    if hasattr(data, 'iloc'):
+        columns = [data.iloc[:, j].tolist() for j in range(data.shape[1])]
+    elif hasattr(data, 'ndim'):
+        if data.ndim != 2:
+            raise Exception('Table data has to be 2 dimensional')
+        columns = data.T.tolist()
+    else:
+        columns = [list(c) for c in zip(*data)]
+    if formats is None or not isinstance(formats, (list, tuple)):
+        formats = [formats]*len(columns)
+    if len(formats) != len(columns):
+        raise Exception('Got {} formats for {} columns'.format(len(formats),
+            len(columns)))
+    converted = list()
+    for fmt, column in zip(formats, columns):
+        if fmt is None:
+            fmt = str
+        elif not hasattr(fmt, '__call__'):
+            fmt = fmt.format if '{' in fmt else fmt.__mod__
+        converted.append(list(map(fmt, column)))
+    return converted
+
+def table_rows(data, formats=None):
+    """ Returns the rows of a table as strings of cells joined by ' & '.
+
+    A list of lists of strings without formats is joined as it is. All other
+    data is converted by `table_columns` first.
+    """
+    if formats is None and not hasattr(data, 'ndim') and \
+            all(type(c) is str for row in data[:1] for c in row):
+        return list(map(' & '.join, data))
+    return list(map(' & '.join, zip(*table_columns(data, formats))))
+
+
 class StandardTemplate:
     """ Class that serves as a namespace. Collects string templates and
     functions to build templates. This class could be inherited to create
@@ -157,6 +335,8 @@ r"""\documentclass[$pagesize,$fontsize]{article}
 \usepackage[$pagesize,$orientation,left=$left,right=$right,top=$top,bottom=$bottom]{geometry}
 \usepackage{caption}
 \usepackage{booktabs}
+\usepackage{longtable}
+\csname endofdump\endcsname
 
 \title{$title}
 \author{$author}
@@ -203,41 +383,112 @@ r"""
         return '\n'.join(part1), '\n'.join(part2)
 
 
+    # compiled templates of all template classes, see `compiled`
+    _compiled = dict()
+
     @classmethod
-    def figure(*args, **kwargs):
-        hascaption = kwargs.has_key('caption')
-        realfloat = kwargs.pop('float', False)
-        pre, suf = Template.float_wrapper(realfloat, hascaption)
+    def compiled(cls, kind, *flags):
+        """ Returns the string.Template(s) built by `cls._<kind>_template(
+        *flags)`. They are only built once per class, kind and flags. Call
+        `clear_compiled` after changing a template class at runtime.
+        """
+        key = (cls, kind) + flags
+        try:
+            return cls._compiled[key]
+        except KeyError:
+            pass
+        parts = getattr(cls, '_' + kind + '_template')(*flags)
+        if isinstance(parts, str):
+            template = string.Template(parts)
+        else:
+            template = tuple(string.Template(p) for p in parts)
+        cls._compiled[key] = template
+        return template
+
+    @classmethod
+    def clear_compiled(cls):
+        cls._compiled.clear()
+
+    @classmethod
+    def _figure_template(cls, realfloat, caption):
+        pre, suf = cls.float_wrapper(realfloat, caption)
         middle = r'  \includegraphics[$dimension=$size]{$fname}'
-        template = string.Template('\n'.join([pre, middle, suf]))
-        return template.substitute(floattype='figure', **kwargs)
-        
+        return '\n'.join([pre, middle, suf])
+
     @classmethod
-    def section(*args,**kwargs):
+    def _section_template(cls, newpage):
         s ='\n'+ r'\$sectiontype$star{$sectiontitle}' + '\n'
-        params = {'star': '*' if kwargs.pop('starred',False) else ''}
-        if kwargs.pop('newpage',False):
+        if newpage:
             s = '\\newpage\n' + s
+        return s
+
+    @classmethod
+    def _table_template(cls, realfloat, caption):
+        pre, suf = cls.float_wrapper(realfloat, caption)
+        top = '\n'.join([pre, r'\begin{tabular}{$cols}', r'  \toprule'])
+        bottom = '\n'.join([r'  \bottomrule', r'\end{tabular}', suf])
+        return top, bottom
+
+    @classmethod
+    def figure(cls, **kwargs):
+        hascaption = 'caption' in kwargs
+        realfloat = bool(kwargs.pop('float', False))
+        template = cls.compiled('figure', realfloat, hascaption)
+        return template.substitute(floattype='figure', **kwargs)
+
+    @classmethod
+    def section(cls, **kwargs):
+        params = {'star': '*' if kwargs.pop('starred',False) else ''}
+        template = cls.compiled('section', bool(kwargs.pop('newpage',False)))
         params.update(kwargs)
-        return string.Template(s).substitute(**params)
+        return template.substitute(**params)
 
     @classmethod
     def table(cls, cols=None, **kwargs):
-        hascaption = kwargs.has_key('caption')
-        realfloat = kwargs.pop('float', False)
-        pre, suf = Template.float_wrapper(realfloat, hascaption)
+        hascaption = 'caption' in kwargs
+        realfloat = bool(kwargs.pop('float', False))
+        top, bottom = cls.compiled('table', realfloat, hascaption)
         data = kwargs.pop('data')
         header = kwargs.pop('header',None)
-        kwargs['cols'] = 'l'*len(data[0]) if cols is None else cols
-        middle = [r'\begin{tabular}{$cols}',r'  \toprule']
+        rows = table_rows(data, kwargs.pop('formats', None))
+        if header is None and hasattr(data, 'columns'):
+            header = [str(c) for c in data.columns]
+        if cols is None:
+            if hasattr(data, 'shape'):
+                ncols = data.shape[1]
+            else:
+                # empty tables take their width from the header
+                ncols = len(data[0]) if len(data) else len(header or ())
+            cols = 'l'*ncols
+        kwargs['cols'] = cols
+        # the header and the rows are not passed through the template, which
+        # saves escaping and substituting large tables
+        top = top.substitute(floattype='table', **kwargs)
         if header is not None:
-            middle.append('  ' + ' & '.join(header).replace('$','$$') + r'\\')
-            middle.append(r'  \midrule')
-        for i in data:
-            middle.append('  ' + ' & '.join(i).replace('$','$$') + r'\\')
-        middle.extend([r'  \bottomrule', r'\end{tabular}'])
-        template = string.Template('\n'.join([pre]+middle+[suf]))
-        return template.substitute(floattype='table', **kwargs)
+            top = '\n'.join([top, '  ' + ' & '.join(header) + r'\\',
+                r'  \midrule'])
+        bottom = bottom.substitute(floattype='table', **kwargs)
+        if not rows:
+            return top + '\n' + bottom
+        body = '  ' + (r'\\' + '\n  ').join(rows) + r'\\'
+        return '\n'.join([top, body, bottom])
+
+    @classmethod
+    def longtable(cls, cols, header=None, caption=None):
+        """Creates the beginning and the end of a longtable. The header is
+        repeated on every page. The rows go in between.
+        """
+        part1 = ['', r'\begin{longtable}{%s}' % cols]
+        if caption is not None:
+            part1.append(r'  \caption{%s}\\' % caption)
+        rule = [r'  \toprule']
+        if header is not None:
+            rule.append('  ' + ' & '.join(header) + r'\\')
+            rule.append(r'  \midrule')
+        part1.extend(rule + [r'  \endfirsthead'] + rule + [r'  \endhead'])
+        part1.extend([r'  \bottomrule', r'  \endfoot', ''])
+        part2 = [r'\end{longtable}', '']
+        return '\n'.join(part1), '\n'.join(part2)
 
     equation = string.Template(\
 r"""\begin{equation}
@@ -250,27 +501,33 @@ $equation
 Template = StandardTemplate
 
 
-def make_table(data, cols=None, header=None, **kwargs):
+def make_table(data, cols=None, header=None, formats=None, **kwargs):
     """Creates a tex block for a table
 
     Parameters
     ----------
-    data: list
+    data: list, numpy.ndarray or pandas.DataFrame
         A list of lists of strings that defines the the elements of the table.
-        The lists are interpreted as a list of rows.
+        The lists are interpreted as a list of rows. 2D arrays and DataFrames
+        are converted column-wise (see `table_columns`).
     cols: str, optional
         Column alignment specifier. The default is `None` and results in
         `'l'*N`, where `N` is the number of columns in data.
     header: list, None
         A list of str that are used as headers (separated from data with a
-        horizontal line)
+        horizontal line). For DataFrames, the column names are used by
+        default.
+    formats: str, callable or list thereof, optional
+        Format specifications for all or each of the columns, e.g. '%.2f' or
+        '{:.2e}'. Default: None (str)
 
     Returns
     -------
     tex_string: str
         The resulting tex string of the table
     """
-    return Template.table(data=data, cols=cols, header=header, **kwargs)
+    return Template.table(data=data, cols=cols, header=header,
+            formats=formats, **kwargs)
 
 def make_section(title, newpage=False, starred=False):
     """ Creates a tex block for a section
@@ -334,11 +591,1279 @@ def make_figure(dimension_spec, size, fname, **kwargs):
     return Template.figure(dimension=dimension_spec, size=size, fname=fname,
             **kwargs)
 
+
+def decimate_line(x, y, buckets, xlim=None):
+    """ Reduces the points of a line with increasing x to at most four per
+    bucket (first, last, minimum and maximum), such that the line looks the
+    same when it is drawn with `buckets` pixels.
+
+    The buckets split xlim (Default: the range of x) evenly, so x has to be
+    in the coordinates of the axis scale (e.g. log10(x) on a log axis).
+    Outside of xlim, only the points next to it are kept, which draw the line
+    to the edge. Points where y is NaN are kept as well, as they break the
+    line.
+
+    Returns the indices of the points that are kept.
+    """
+    import numpy as np
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lo, hi = (x[0], x[-1]) if xlim is None else sorted(xlim)
+    span = hi - lo
+    if span <= 0:
+        return np.arange(len(x))
+    first = np.searchsorted(x, lo, 'left')
+    last = np.searchsorted(x, hi, 'right')
+    edges = [i for i in (first - 1, last) if 0 <= i < len(x)]
+    if first == last:
+        return np.array(edges, dtype=int)
+    x, y = x[first:last], y[first:last]
+    bucket = np.minimum(((x - lo) / span * buckets).astype(int),
+            buckets - 1)
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    ends = np.append(starts[1:], len(x)) - 1
+    counts = ends - starts + 1
+    # fmin / fmax ignore NaNs, which would otherwise hide the whole bucket
+    mins = np.repeat(np.fmin.reduceat(y, starts), counts)
+    maxs = np.repeat(np.fmax.reduceat(y, starts), counts)
+    keep = (y == mins) | (y == maxs) | np.isnan(y)
+    keep[starts] = True
+    keep[ends] = True
+    return np.union1d(np.flatnonzero(keep) + first, edges).astype(int)
+
+
+def simplify_figure(fig, raster_threshold, dpi, undo=None):
+    """ Makes dense plots cheap to store as vector graphics.
+
+    Lines with more than `raster_threshold` points and monotonic x data are
+    decimated to the pixel columns of the visible part of their axes (see
+    `decimate_line`), through the scale of the x axis. All other artists
+    with more points (e.g. scatter plots, lines with markers) are rasterized
+    at `dpi`, while text and axes stay vectors.
+
+    This changes the artists of fig. If undo is a list, the changes are
+    recorded in it as (function, args) pairs that undo them when they are
+    called in reverse order.
+
+    Returns
+    -------
+    stats: dict
+        The number of 'rasterized' artists, 'decimated' lines and the number
+        of line points before ('points_before') and after ('points_after')
+        decimation.
+    """
+    import numpy as np
+    from matplotlib.lines import Line2D
+    from matplotlib.collections import Collection
+    stats = dict(rasterized=0, decimated=0, points_before=0, points_after=0)
+    width_in = fig.get_size_inches()[0]
+    for ax in fig.axes:
+        buckets = max(int(ax.get_position().width * width_in * dpi), 1)
+        scale = ax.xaxis.get_transform()
+        # fixes the view limits before the data changes
+        xlim = scale.transform(np.asarray(ax.get_xlim(), dtype=float))
+        ax.get_ylim()
+        for artist in ax.get_children():
+            if isinstance(artist, Line2D):
+                x, y = artist.get_xdata(orig=False), artist.get_ydata(
+                        orig=False)
+                n = len(x)
+                if n <= raster_threshold:
+                    continue
+                marker = artist.get_marker()
+                sx = scale.transform(np.asarray(x, dtype=float))
+                if (marker in (None, '', ' ', 'None', 'none') and
+                        artist.get_transform() == ax.transData and
+                        np.all(np.isfinite(sx)) and
+                        np.all(np.isfinite(xlim)) and
+                        np.all(np.diff(sx) >= 0)):
+                    idx = decimate_line(sx, y, buckets, xlim)
+                    if undo is not None:
+                        undo.append((artist.set_data, (artist.get_xdata(),
+                            artist.get_ydata())))
+                    artist.set_data(np.asarray(x)[idx], np.asarray(y)[idx])
+                    stats['decimated'] += 1
+                    stats['points_before'] += n
+                    stats['points_after'] += len(idx)
+                else:
+                    if undo is not None:
+                        undo.append((artist.set_rasterized,
+                            (artist.get_rasterized(),)))
+                    artist.set_rasterized(True)
+                    stats['rasterized'] += 1
+            elif isinstance(artist, Collection):
+                n = max(len(artist.get_offsets()), len(artist.get_paths()))
+                if n > raster_threshold:
+                    if undo is not None:
+                        undo.append((artist.set_rasterized,
+                            (artist.get_rasterized(),)))
+                    artist.set_rasterized(True)
+                    stats['rasterized'] += 1
+    return stats
+
+
+# figures handed out by pooled_figure, by size
+_figure_pool = dict()
+
+def pooled_figure(figsize=None, **kwargs):
+    """ Returns an empty pyplot figure of size figsize, which is reused by all
+    plots of that size instead of creating a new figure each time. It can be
+    used by generators in place of plt.figure. The keyword arguments are
+    passed to plt.figure when the figure is created. Pooled figures are not
+    closed by the report.
+
+    Do not use it with `AsyncReport`: the next generator would clear the
+    figure while it is saved in the worker thread.
+    """
+    import matplotlib
+    import matplotlib.pyplot as plt
+    figsize = tuple(figsize or matplotlib.rcParams['figure.figsize'])
+    fig = _figure_pool.get(figsize)
+    if fig is None or not plt.fignum_exists(fig.number):
+        fig = _figure_pool[figsize] = plt.figure(figsize=figsize, **kwargs)
+    else:
+        fig.clf()
+        fig.set_size_inches(*figsize)
+        plt.figure(fig.number)
+    return fig
+
+def _pooled(fig):
+    return any(fig is f for f in _figure_pool.values())
+
+def limit_figures(max_figures):
+    """ Closes the oldest open pyplot figures (except pooled ones), until at
+    most max_figures are left. Returns the number of closed figures.
+    """
+    plt = sys.modules.get('matplotlib.pyplot')
+    if plt is None:
+        return 0
+    pooled = set(f.number for f in _figure_pool.values())
+    numbers = [n for n in plt.get_fignums() if n not in pooled]
+    excess = numbers[:max(0, len(numbers) - max_figures)]
+    for n in excess:
+        plt.close(n)
+    return len(excess)
+
+def memory_usage():
+    """ Returns the number of open pyplot 'figures' and the peak resident
+    memory of this process in bytes ('max_rss', not available on windows).
+    """
+    plt = sys.modules.get('matplotlib.pyplot')
+    usage = dict(figures=len(plt.get_fignums()) if plt is not None else 0)
+    try:
+        import resource
+    except ImportError:
+        return usage
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    usage['max_rss'] = rss if sys.platform == 'darwin' else rss * 1024
+    return usage
+
+
+def _save_figure(fig, filename, dimension, target, raster_threshold, measure,
+        stats):
+    """ Scales fig to the target size, simplifies and saves it. Timings and
+    sizes go into stats, see `render_figure`.
+
+    The figure is saved to a temporary file that replaces filename, so a
+    file that is hard linked to a `FigureStore` is never written in place.
+    The simplification is undone after saving, so a figure of the caller
+    still holds all of its data.
+    """
+    import matplotlib
+    t = time.time()
+    fsize = [i.item() for i in fig.get_size_inches()]
+    target = target.with_dpi(0.9*72.)# fig.get_dpi() #slightly smaller to
+                        # account for slightly heavier fonts compared to latex
+    if dimension == 'width':
+        scale = target.convert_to('in').value / fsize[0]
+    else:
+        scale = target.convert_to('in').value / fsize[1]
+    fig.set_size_inches(*[i*scale for i in fsize], forward=True)
+    fig.gca().relim()
+    stats['timings'].append(('resize', t, time.time() - t))
+    undo = list()
+    try:
+        if raster_threshold is not None:
+            t = time.time()
+            if measure:
+                buf = io.BytesIO()
+                fig.savefig(buf, format=os.path.splitext(filename)[1][1:])
+                stats['size_before'] = buf.tell()
+            dpi = matplotlib.rcParams['savefig.dpi']
+            stats.update(simplify_figure(fig, raster_threshold,
+                fig.get_dpi() if dpi == 'figure' else dpi, undo))
+            stats['timings'].append(('simplify', t, time.time() - t))
+        t = time.time()
+        tmp = '{}.{}-{:x}.tmp'.format(filename, os.getpid(), id(fig))
+        try:
+            fig.savefig(tmp, format=os.path.splitext(filename)[1][1:])
+            os.replace(tmp, filename)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        stats['timings'].append(('savefig', t, time.time() - t))
+    finally:
+        for f, args in reversed(undo):
+            f(*args)
+    stats['size'] = os.path.getsize(filename)
+
+
+# rcParams of draft figures: mathtext instead of latex
+draft_rc = {'text.usetex': False}
+
+def _draft_context(draft):
+    if not draft:
+        return contextlib.nullcontext()
+    import matplotlib
+    return matplotlib.rc_context(draft_rc)
+
+# hits and misses of the usetex cache in this process, see use_tex_cache
+tex_cache_stats = dict(hits=0, misses=0)
+
+def use_tex_cache(directory):
+    """ Makes matplotlib keep the text it typesets with latex (usetex) in
+    directory, which can be shared by processes and runs: matplotlib names
+    the files after a hash of the text and the preamble and replaces them
+    atomically. Lookups are counted in `tex_cache_stats`.
+    """
+    from matplotlib.texmanager import TexManager
+    directory = os.path.abspath(directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    if hasattr(TexManager, '_cache_dir'):
+        import pathlib
+        TexManager._cache_dir = pathlib.Path(directory)
+    else:
+        TexManager.texcache = directory
+    make_dvi = TexManager.__dict__['make_dvi']
+    if getattr(make_dvi, '_pyreporter', False):
+        return
+    method = isinstance(make_dvi, classmethod)
+    original = make_dvi.__func__ if method else make_dvi
+
+    @functools.wraps(original)
+    def counting_make_dvi(self, tex, fontsize):
+        hit = os.path.exists(self.get_basefile(tex, fontsize) + '.dvi')
+        tex_cache_stats['hits' if hit else 'misses'] += 1
+        return original(self, tex, fontsize)
+
+    wrapped = classmethod(counting_make_dvi) if method else counting_make_dvi
+    wrapped._pyreporter = True
+    TexManager.make_dvi = wrapped
+
+
+def render_figure(fig, filename, dimension, target, args=(), rc=None,
+        raster_threshold=None, measure=False, close=False, max_figures=None,
+        draft=False, tex_cache=None):
+    """ Scales a matplotlib figure to the target size and saves it.
+
+    Parameters
+    ----------
+    fig: a matplotlib.Figure or a callable
+        Either a matplotlib figure, or a function that returns one
+    filename: str
+        The file the figure is saved to
+    dimension: str
+        The dimension target refers to {'width', 'height'}
+    target: Length
+        The size of the figure in the document
+    args: tuple, optional
+        Arguments that are passed to the generator `fig`. Default: ()
+    rc: dict, optional
+        rcParams that are applied before the generator is called. This is
+        used to render figures in worker processes. Default: None
+    raster_threshold: int, optional
+        If set, dense artists are decimated or rasterized (see
+        `simplify_figure`). Default: None
+    measure: bool, optional
+        If true, the figure is additionally saved to memory before it is
+        simplified, to measure the size it would have had. Default: False
+    close: bool, optional
+        If true, a figure that was created by the generator `fig` is closed
+        after it was saved (unless it is a `pooled_figure`). Default: False
+    max_figures: int, optional
+        If set, the oldest open pyplot figures are closed after saving, until
+        at most max_figures are left (see `limit_figures`). Default: None
+    draft: bool, optional
+        If true, the text is rendered with mathtext instead of latex (see
+        `draft_rc`), which is much faster. Default: False
+    tex_cache: str, optional
+        A directory for the text typeset by latex (see `use_tex_cache`).
+        Default: None
+
+    Returns
+    -------
+    stats: dict
+        The statistics of `simplify_figure` plus the file 'size' in bytes and,
+        if measured, the size before simplification ('size_before'). 'timings'
+        lists the phases as (name, start time, duration) and 'pid' is the
+        process that rendered the figure. The `memory_usage` after saving is
+        included as well as the number of 'closed_figures' and the hits and
+        misses of the usetex cache ('tex_hits', 'tex_misses').
+    """
+    import matplotlib
+    if rc is not None:
+        matplotlib.rcParams.update(rc)
+    if tex_cache is not None:
+        use_tex_cache(tex_cache)
+    tex_before = dict(tex_cache_stats)
+    stats = dict(pid=os.getpid(), timings=list(), closed_figures=0)
+    t = time.time()
+    created = hasattr(fig, '__call__')
+    try:
+        with _draft_context(draft):
+            if created:
+                fig = fig(*args)
+                stats['timings'].append(('generator', t, time.time() - t))
+            if draft:
+                import matplotlib.text
+                for text in fig.findobj(matplotlib.text.Text):
+                    text.set_usetex(False)
+            _save_figure(fig, filename, dimension, target, raster_threshold,
+                    measure, stats)
+    finally:
+        if close and created and not hasattr(fig, '__call__') and \
+                not _pooled(fig):
+            plt = sys.modules.get('matplotlib.pyplot')
+            if plt is not None:
+                plt.close(fig)
+                stats['closed_figures'] += 1
+    if max_figures is not None:
+        stats['closed_figures'] += limit_figures(max_figures)
+    stats.update(memory_usage())
+    stats['tex_hits'] = tex_cache_stats['hits'] - tex_before['hits']
+    stats['tex_misses'] = tex_cache_stats['misses'] - tex_before['misses']
+    msg = "writing plot: %s (%.1f kB" % (filename, stats['size']/1024.)
+    if 'size_before' in stats:
+        msg += ", %.1f kB without simplification" % (
+                stats['size_before']/1024.)
+    if stats.get('rasterized') or stats.get('decimated'):
+        msg += ", %d rasterized, %d decimated: %d -> %d points" % (
+            stats['rasterized'], stats['decimated'], stats['points_before'],
+            stats['points_after'])
+    print(msg + ")")
+    return stats
+
+
+class FigureError(Exception):
+    """ Raised if deferred figures could not be rendered. The attribute
+    `failures` maps the figure names to the corresponding errors.
+    """
+    def __init__(self, failures):
+        self.failures = failures
+        msg = '\n'.join('{}: {!r}'.format(name, err) for name, err in
+                failures.items())
+        Exception.__init__(self, 'Could not render {} figure(s):\n{}'.format(
+            len(failures), msg))
+
+
+def figure_digest(key, args, dimension, target, frmt, depends=(),
+        code=None, generator=None):
+    """ Computes the cache key of a figure.
+
+    The key covers everything that influences the rendered file: the user
+    supplied key and generator arguments, the target size, the file format and
+    the active matplotlib rcParams. Keys and arguments should have a stable
+    repr (strings, numbers and tuples / lists / dicts thereof). If given, the
+    name of the generator (see `generator_name`), the contents of the files in
+    depends and the digest of the generator code (see `code_digest`) are
+    covered as well.
+    """
+    import matplotlib
+    rc = sorted((k, repr(v)) for k, v in matplotlib.rcParams.items())
+    content = (key, tuple(args), dimension, repr(target), frmt, rc)
+    if generator is not None:
+        content += (generator,)
+    if depends:
+        content += (tuple((p, file_digest(p)) for p in depends),)
+    if code is not None:
+        content += (code,)
+    content = repr(content)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def generator_name(f):
+    """ Returns the qualified name of the plot generator f (of the function it
+    wraps for functools.partial objects), e.g. 'plots.histogram'. Edits of
+    the code of a generator do not change its name, see `code_digest`.
+    """
+    while isinstance(f, functools.partial):
+        f = f.func
+    return '{}.{}'.format(getattr(f, '__module__', None),
+            getattr(f, '__qualname__', type(f).__qualname__))
+
+
+_default_repr = re.compile(r' at 0x[0-9a-fA-F]+>')
+
+def code_digest(f):
+    """ Returns a digest of the code of the plot generator f and of what it
+    refers to: default arguments, closures and globals, recursing into the
+    functions of the module of the generator (for functools.partial objects,
+    the function they wrap). Edits of a generator or of the functions it
+    calls change the digest.
+
+    Values are included by their repr, containers by their items, numpy
+    arrays by their data and pandas objects by their hash, as the repr of
+    large arrays is abbreviated. Objects whose repr is the default one (with
+    their address) change the digest on every run.
+    """
+    h = hashlib.sha1()
+    seen = set()
+    inner = f
+    while isinstance(inner, functools.partial):
+        inner = inner.func
+    module = getattr(inner, '__module__', None)
+
+    def names(code):
+        result = list(code.co_names)
+        for const in code.co_consts:
+            if hasattr(const, 'co_code'):
+                result.extend(names(const))
+        return result
+
+    def feed_code(code):
+        h.update(code.co_code)
+        for const in code.co_consts:
+            if hasattr(const, 'co_code'):
+                feed_code(const)
+            else:
+                h.update(repr(const).encode('utf-8'))
+        h.update(repr(code.co_names).encode('utf-8'))
+
+    def feed(obj):
+        if isinstance(obj, functools.partial):
+            feed(obj.func)
+            feed(obj.args)
+            feed(sorted(obj.keywords.items()))
+        elif hasattr(obj, '__code__') and obj.__module__ == module:
+            if id(obj) in seen:
+                return
+            seen.add(id(obj))
+            feed_code(obj.__code__)
+            for value in obj.__defaults__ or ():
+                feed(value)
+            for cell in obj.__closure__ or ():
+                feed(cell.cell_contents)
+            for name in names(obj.__code__):
+                value = obj.__globals__.get(name, h)
+                if value is not h and not isinstance(value, type(os)):
+                    feed(value)
+        elif hasattr(obj, '__code__') or isinstance(obj, type):
+            h.update('{}.{}'.format(obj.__module__,
+                obj.__qualname__).encode('utf-8'))
+        elif isinstance(obj, (list, tuple, dict, set, frozenset)):
+            if id(obj) in seen:
+                return
+            seen.add(id(obj))
+            h.update('{}{}'.format(type(obj).__name__, len(obj)).encode(
+                'utf-8'))
+            if isinstance(obj, dict):
+                obj = list(obj.items())
+            elif isinstance(obj, (set, frozenset)):
+                # the order of sets changes between runs
+                obj = sorted(obj, key=repr)
+            for item in obj:
+                feed(item)
+        elif type(obj).__module__ == 'numpy' and hasattr(obj, 'tobytes'):
+            h.update(repr((obj.dtype.str, obj.shape)).encode('utf-8'))
+            if obj.dtype.hasobject:
+                feed(obj.tolist())
+            else:
+                h.update(obj.tobytes())
+        elif type(obj).__module__.split('.')[0] == 'pandas':
+            try:
+                import pandas
+                h.update(pandas.util.hash_pandas_object(obj).values.tobytes())
+                feed(list(getattr(obj, 'columns', ())))
+            except Exception:
+                h.update(os.urandom(16))
+        else:
+            text = repr(obj)
+            if _default_repr.search(text):
+                # the address changes on every run and so does the object
+                h.update(os.urandom(16))
+            else:
+                h.update(text.encode('utf-8'))
+
+    feed(f)
+    return h.hexdigest()
+
+
+class FigureCache(object):
+    """ Keeps track of the inputs the figures in a directory were rendered
+    from.
+
+    The digests (see `figure_digest`) are stored in a json manifest inside the
+    figure directory. A figure only needs to be rendered again if its digest
+    changed or its file is missing.
+
+    Reports in the same working directory share the figure directory, so
+    every report keeps its own manifest (named after owner, usually the name
+    of the report). The manifest lists all figures of the report, those that
+    are not cached with the digest None.
+    """
+    manifest_name = '.pyreporter-cache.json'
+
+    def __init__(self, directory, owner=None):
+        self.directory = directory
+        name = self.manifest_name
+        if owner is not None:
+            name = '{}-{}.json'.format(os.path.splitext(name)[0], owner)
+        self.manifest = os.path.join(directory, name)
+        self.hits = 0
+        self.misses = 0
+        self.used = set()
+        try:
+            with open(self.manifest) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def lookup(self, filename, digest):
+        """ Returns True if filename exists and was rendered from digest.
+        Updates the hit / miss counters.
+        """
+        name = os.path.basename(filename)
+        self.used.add(name)
+        if self.entries.get(name) == digest and os.path.exists(filename):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def store(self, filename, digest):
+        """ Records that filename was rendered from digest
+        """
+        name = os.path.basename(filename)
+        self.used.add(name)
+        self.entries[name] = digest
+
+    def touch(self, filename):
+        """ Marks filename as used without caching it
+        """
+        name = os.path.basename(filename)
+        self.used.add(name)
+        self.entries.setdefault(name, None)
+
+    def evict_orphans(self):
+        """ Removes the figure files of this manifest that were not used
+        since the cache was loaded and drops their entries. Files that are
+        not in the manifest or that another manifest in the directory lists
+        are kept.
+
+        Returns
+        -------
+        removed: list
+            The filenames that were removed
+        """
+        others = set()
+        prefix = os.path.splitext(self.manifest_name)[0]
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(prefix) and name.endswith('.json') and \
+                    path != self.manifest:
+                try:
+                    with open(path) as f:
+                        others.update(json.load(f))
+                except (IOError, ValueError):
+                    pass
+        removed = list()
+        for name in list(self.entries):
+            if name in self.used:
+                continue
+            del self.entries[name]
+            path = os.path.join(self.directory, name)
+            if name not in others and os.path.isfile(path):
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+    def save(self):
+        """ Writes the manifest to disk
+        """
+        with AtomicWriter(self.manifest) as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+class Journal(object):
+    """ An append-only log of the elements of a report, from which a rerun of
+    an interrupted report resumes (see the attribute `resume` of Report).
+
+    Every line is a json object: the elements in the order they were added,
+    with the digest of their tex ('node' lines), and the rendered figures,
+    with the digest of their file ('figure' lines). A figure is identified by
+    its position among the plots of the report and by what `figure_digest`
+    covers, including the code of its generator. Each line holds a hash
+    chained to the line before it, so a journal that was cut off or damaged
+    is only used up to its last intact line.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.nodes = list()
+        self.figures = dict()
+        self.position = 0
+        self.plots = 0
+        self.verified = 0
+        self.replayed = 0
+        self.diverged = None
+        self._lines = list()
+        self._chain = ''
+        intact = True
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        chain = entry.pop('chain')
+                    except (ValueError, KeyError):
+                        intact = False
+                        break
+                    if chain != self._link(entry):
+                        intact = False
+                        break
+                    self._add(entry, chain)
+        except IOError:
+            pass
+        if not intact:
+            self._rewrite()
+        self._file = open(path, 'a')
+
+    def _link(self, entry):
+        content = self._chain + json.dumps(entry, sort_keys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+    def _add(self, entry, chain):
+        self._chain = chain
+        self._lines.append(entry)
+        if 'node' in entry:
+            self.nodes.append(entry['tex'])
+        else:
+            self.figures[entry['figure']] = entry
+
+    def _write(self, entry):
+        chain = self._link(entry)
+        self._add(entry, chain)
+        entry = dict(entry, chain=chain)
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _rewrite(self):
+        """ Writes the entries that are left, with new hashes
+        """
+        lines, self._lines = self._lines, list()
+        self.nodes, self.figures, self._chain = list(), dict(), ''
+        with AtomicWriter(self.path) as f:
+            for entry in lines:
+                chain = self._link(entry)
+                self._add(entry, chain)
+                f.write(json.dumps(dict(entry, chain=chain),
+                    sort_keys=True) + '\n')
+
+    def node(self, node):
+        """ Records node as the next element of the report. Within the
+        elements of an earlier run, it is only compared to the recorded one.
+        At the first difference, the rest of the earlier run is dropped.
+        """
+        digest = hashlib.sha1((node.kind + '\n' + node.tex()).encode(
+            'utf-8')).hexdigest()
+        position, self.position = self.position, self.position + 1
+        if position < len(self.nodes):
+            if self.nodes[position] == digest:
+                self.verified += 1
+                return
+            self.diverged = position
+            self._file.close()
+            self._lines = [e for e in self._lines if e.get('node', -1) <
+                    position]
+            self._rewrite()
+            self._file = open(self.path, 'a')
+        self._write(dict(node=position, kind=node.kind, tex=digest))
+
+    def next_plot(self, spec):
+        """ Returns the identifier of the next plot, whose inputs have the
+        digest spec
+        """
+        self.plots += 1
+        return '{}:{}'.format(self.plots, spec)
+
+    def figure(self, plot):
+        """ Returns the (name, filename) of the figure that was rendered for
+        plot, if its file is unchanged, otherwise None
+        """
+        entry = self.figures.get(plot)
+        if entry is None or not os.path.exists(entry['file']) or \
+                file_digest(entry['file']) != entry['sha1']:
+            return None
+        self.replayed += 1
+        return entry['name'], entry['file']
+
+    def rendered(self, plot, name, filename):
+        """ Records that the figure of plot was rendered to filename
+        """
+        self._write(dict(figure=plot, name=name, file=filename,
+            sha1=file_digest(filename)))
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """ Closes the journal and deletes its file
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class FigureStore(object):
+    """ A content addressed store for figures that can be shared by many
+    reports (and processes).
+
+    Figures are stored under their digest (see `figure_digest`) and hard
+    linked (or copied, if that is not possible) into the figure directories
+    of the reports. Identical figures are therefore only rendered once. For
+    figures from generators, the digest covers the code of the generator
+    (see `code_digest`), as the store is shared beyond a single report.
+    Figures are rendered to a new file that replaces the old one, so
+    rendering never changes a stored figure. The modification time of a
+    stored figure is updated whenever it is used, which allows to evict the
+    least recently used ones.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory of the store. It is created if it does not exist.
+        max_bytes: int, optional
+            The size limit that is enforced by `gc`. Default: None (no limit)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def path(self, digest, filename):
+        """ The path of the stored figure with digest in the format of
+        filename.
+        """
+        return os.path.join(self.directory,
+                digest + os.path.splitext(filename)[1])
+
+    @staticmethod
+    def _link(src, dst):
+        tmp = '{}.{}.tmp'.format(dst, os.getpid())
+        try:
+            os.link(src, tmp)
+        except OSError:
+            import shutil
+            shutil.copyfile(src, tmp)
+        os.rename(tmp, dst)
+
+    def fetch(self, digest, filename):
+        """ Links the stored figure to filename. Returns False if there is no
+        figure with this digest.
+        """
+        path = self.path(digest, filename)
+        try:
+            self._link(path, filename)
+        except (IOError, OSError):
+            self.misses += 1
+            return False
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return True
+
+    def put(self, digest, filename):
+        """ Adds the rendered figure filename to the store
+        """
+        self._link(filename, self.path(digest, filename))
+
+    def gc(self, max_bytes=None):
+        """ Removes the least recently used figures until the store is not
+        larger than max_bytes (Default: the attribute `max_bytes`). Leftovers
+        of interrupted writes are removed as well.
+
+        Returns
+        -------
+        removed: list
+            The paths of the removed figures
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed, files, total = list(), list(), 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.tmp') and time.time() - st.st_mtime > 3600:
+                removed.append(path)
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        while max_bytes is not None and total > max_bytes and files:
+            _, size, path = files.pop(0)
+            removed.append(path)
+            total -= size
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return removed
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler(object):
+    """ A profiler that records nothing. This is the default of Report.
+    """
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, category, name):
+        return self._span
+
+    def record_plot(self, name, stats):
+        pass
+
+    def record_build(self, result):
+        pass
+
+
+class _Span(object):
+    def __init__(self, events, category, name):
+        self.events = events
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.events.append((self.category, self.name, self.start,
+            time.time() - self.start, os.getpid(), None))
+        return False
+
+
+class Profiler(object):
+    """ Records the time spent on the elements of a Report.
+
+    Set the attribute `profiler` of a Report to an instance to record the
+    figure generators, resizing, simplification and saving of figures
+    (keyed by figure name, with the file size), the time each node (e.g.
+    sections by title, tables) takes to render and write, and the latex
+    passes. When the report is closed, a summary is printed and a trace in
+    the Chrome trace event format is written next to the tex file, which
+    can be loaded into chrome://tracing or Perfetto.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.events = list()
+
+    def span(self, category, name):
+        """ Returns a context manager that records the time spent in it
+        """
+        return _Span(self.events, category, name)
+
+    def record_plot(self, name, stats):
+        """ Records the timings returned by render_figure
+        """
+        for phase, start, duration in stats.get('timings', ()):
+            self.events.append((phase, name, start, duration,
+                stats.get('pid', os.getpid()), dict(size=stats.get('size'))))
+
+    def record_build(self, result):
+        """ Records the latex passes of a build result
+        """
+        for i, (start, duration) in enumerate(zip(result['pass_starts'],
+                result['pass_times'])):
+            self.events.append(('latex', 'pass {}'.format(i + 1), start,
+                duration, os.getpid(), dict(status=result['status'])))
+
+    def totals(self):
+        """ Returns a dict mapping categories to (count, total seconds)
+        """
+        totals = dict()
+        for category, _, _, duration, _, _ in self.events:
+            count, total = totals.get(category, (0, 0.))
+            totals[category] = (count + 1, total + duration)
+        return totals
+
+    def summary(self, top=10):
+        """ Returns a text summary with the totals per category and the
+        slowest elements
+        """
+        lines = ['{:<16} {:>8} {:>12}'.format('category', 'count', 'seconds')]
+        for category, (count, total) in sorted(self.totals().items(),
+                key=lambda x: -x[1][1]):
+            lines.append('{:<16} {:>8} {:>12.3f}'.format(category, count,
+                total))
+        lines.append('slowest:')
+        for category, name, _, duration, _, _ in sorted(self.events,
+                key=lambda e: -e[3])[:top]:
+            lines.append('  {:>10.3f}s {}: {}'.format(duration, category,
+                name))
+        return '\n'.join(lines)
+
+    def trace(self):
+        """ Returns the events in the Chrome trace event format
+        """
+        events = list()
+        for category, name, start, duration, pid, args in self.events:
+            event = dict(name='{}: {}'.format(category, name), cat=category,
+                    ph='X', ts=start*1e6, dur=duration*1e6, pid=pid, tid=pid)
+            if args:
+                event['args'] = args
+            events.append(event)
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def save(self, path):
+        """ Writes the trace to a json file
+        """
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+class Node(object):
+    """ An element of the document tree of a Report.
+
+    Nodes render their tex lazily, when the report is written. Sections
+    contain the nodes that follow them as children.
+    """
+    kind = 'node'
+
+    def __init__(self):
+        self.children = list()
+
+    def tex(self):
+        """ Returns the tex of this node without its children
+        """
+        return ''
+
+    def label(self):
+        """ A short description of the node for profiles
+        """
+        return self.kind
+
+    def write(self, f, profiler=None):
+        """ Writes the node and its children to the file f. The time this
+        takes is recorded by profiler if it is given.
+        """
+        if profiler is None:
+            profiler = NullProfiler()
+        with profiler.span(self.kind, self.label()):
+            f.write(self.tex())
+            for child in self.children:
+                child.write(f, profiler)
+
+    def walk(self):
+        """ Iterates over this node and all its descendants in document order
+        """
+        yield self
+        for child in self.children:
+            for node in child.walk():
+                yield node
+
+
+class Text(Node):
+    """ A node with a fixed tex string
+    """
+    kind = 'text'
+
+    def __init__(self, text):
+        Node.__init__(self)
+        self.text = text
+
+    def tex(self):
+        return self.text
+
+
+class Section(Node):
+    """ A (sub/subsub)section. level is 0 for sections, 1 for subsections and
+    2 for subsubsections.
+    """
+    kind = 'section'
+
+    def __init__(self, title, level=0, newpage=False, starred=False):
+        Node.__init__(self)
+        self.title = title
+        self.level = level
+        self.newpage = newpage
+        self.starred = starred
+
+    def label(self):
+        return self.title
+
+    def tex(self):
+        make = [make_section, make_subsection, make_subsubsection][self.level]
+        return make(self.title, newpage=self.newpage, starred=self.starred)
+
+
+class Equation(Node):
+    """ An equation, see make_equation
+    """
+    kind = 'equation'
+
+    def __init__(self, content):
+        Node.__init__(self)
+        self.content = content
+
+    def tex(self):
+        return make_equation(content=self.content)
+
+
+class Table(Node):
+    """ A table, see make_table. The data is converted when the node is
+    written. Lists of rows (and the header) are copied, as callers may reuse
+    them for the next table; arrays and DataFrames are kept as they are.
+    """
+    kind = 'table'
+
+    def __init__(self, data, **kwargs):
+        Node.__init__(self)
+        if isinstance(data, (list, tuple)):
+            data = [list(row) for row in data]
+        if isinstance(kwargs.get('header'), list):
+            kwargs['header'] = list(kwargs['header'])
+        self.data = data
+        self.kwargs = kwargs
+
+    def tex(self):
+        return make_table(self.data, **self.kwargs)
+
+
+class TableStream(Node):
+    """ A table whose rows are read from an iterable while it is written,
+    see Report.add_table_stream.
+    """
+    kind = 'table'
+
+    def __init__(self, rows, cols=None, header=None, formats=None,
+            caption=None, threshold=500, chunksize=1000, **kwargs):
+        Node.__init__(self)
+        self.rows = rows
+        self.cols = cols
+        self.header = header
+        self.formats = formats
+        self.caption = caption
+        self.threshold = threshold
+        self.chunksize = chunksize
+        self.kwargs = kwargs
+
+    def write(self, f, profiler=None):
+        if profiler is not None:
+            with profiler.span(self.kind, self.label()):
+                return self.write(f)
+        rows = iter(self.rows)
+        first = list(itertools.islice(rows, self.threshold + 1))
+        if not first and self.cols is None and self.header is None:
+            # nothing tells the width of an empty table
+            return
+        if len(first) <= self.threshold:
+            kwargs = dict(self.kwargs)
+            if self.caption is not None:
+                kwargs['caption'] = self.caption
+            f.write(make_table(first, cols=self.cols, header=self.header,
+                    formats=self.formats, **kwargs))
+            return
+        cols = 'l'*len(first[0]) if self.cols is None else self.cols
+        pre, suf = Template.longtable(cols, header=self.header,
+                caption=self.caption)
+        f.write(pre)
+        chunk = first
+        while chunk:
+            f.write('  ' + (r'\\' + '\n  ').join(
+                table_rows(chunk, self.formats)) + r'\\' + '\n')
+            chunk = list(itertools.islice(rows, self.chunksize))
+        f.write(suf)
+
+
+class Figure(Node):
+    """ A figure created by Report.make_plot. The file is rendered
+    separately, the node only holds the tex block.
+    """
+    kind = 'figure'
+
+    def __init__(self, name, filename, text):
+        Node.__init__(self)
+        self.name = name
+        self.filename = filename
+        self.text = text
+
+    def label(self):
+        return self.name
+
+    def tex(self):
+        return self.text
+
+
+class AtomicWriter(object):
+    """ A file-like object that buffers the text written to it and writes it
+    in blocks of `flush_size` bytes to a temporary file next to path. The
+    temporary file replaces path when the writer is closed, so readers never
+    see a partially written file. If the writer is left by an exception, path
+    is left untouched.
+
+    Parameters
+    ----------
+    path: str
+        The file to write
+    flush_size: int, optional
+        The number of bytes that are buffered before they are written.
+        Default: 65536
+    compress: bool, optional
+        If true, the file is gzip compressed. Default: False
+    only_if_changed: bool, optional
+        If true, path is only replaced if the content changed. Default: False
+    """
+    def __init__(self, path, flush_size=1 << 16, compress=False,
+            only_if_changed=False):
+        self.path = path
+        self.flush_size = flush_size
+        self.only_if_changed = only_if_changed
+        self.replaced = False
+        # unique per process and writer, created with the permissions a new
+        # file would get
+        self.tmp = '{}.{}-{:x}.tmp'.format(path, os.getpid(), id(self))
+        fd = os.open(self.tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self._raw = os.fdopen(fd, 'wb', buffering=0)
+        sink = self._raw
+        if compress:
+            import gzip
+            sink = gzip.GzipFile(os.path.basename(path), 'wb',
+                    fileobj=self._raw, mtime=0)
+        # the buffering and encoding is done by io in C, write is bound
+        # directly to avoid a python level call per write
+        self._file = io.TextIOWrapper(io.BufferedWriter(sink, flush_size),
+                encoding='utf-8')
+        self.write = self._file.write
+        self.flush = self._file.flush
+
+    def _close_files(self):
+        self._file.close()
+        if not self._raw.closed:
+            self._raw.close()
+
+    def close(self):
+        """ Writes the rest of the text and replaces path by the written file
+        """
+        if self._raw.closed:
+            return
+        self._close_files()
+        if self.only_if_changed and os.path.exists(self.path) and \
+                file_digest(self.path) == file_digest(self.tmp):
+            os.remove(self.tmp)
+            return
+        os.replace(self.tmp, self.path)
+        self.replaced = True
+
+    def discard(self):
+        """ Closes the writer and removes the temporary file without touching
+        path
+        """
+        self._close_files()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def expand_tex(fname):
+    """ Writes the tex file fname from its compressed version fname.gz (see
+    `Report.compress`), unless fname is newer.
+    """
+    import gzip
+    import shutil
+    compressed = fname + '.gz'
+    if os.path.exists(fname) and \
+            os.path.getmtime(fname) >= os.path.getmtime(compressed):
+        return
+    tmp = fname + '.tmp'
+    with gzip.open(compressed, 'rb') as src, open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, fname)
+
+
+# counters that continue from one part of a report to the next
+_part_counters = ('page', 'section', 'figure', 'table', 'equation')
+
+# writes the counters at the end of a part to its aux file
+_part_tail = r"""
+\clearpage
+\makeatletter
+\immediate\write\@mainaux{\string\pyreportercounters{\the\numexpr\value{page}-1\relax}{\arabic{section}}{\arabic{figure}}{\arabic{table}}{\arabic{equation}}}
+\makeatother"""
+
+def _part_start(start):
+    """ The tex that sets the counters at the start of a part
+    """
+    return ''.join('\\setcounter{%s}{%d}\n' % (counter, value)
+            for counter, value in zip(_part_counters, start))
+
+_part_counters_aux = re.compile(r'\\pyreportercounters' + r'\{(\d+)\}' * 5)
+
+def _read_part_counters(fname):
+    """ Returns the counters at the end of a built part (see
+    `Report.write_parts`), or None if they are not in its aux file.
+    """
+    aux = os.path.splitext(fname)[0] + '.aux'
+    if not os.path.exists(aux):
+        return None
+    with open(aux) as f:
+        match = _part_counters_aux.search(f.read())
+    return None if match is None else [int(v) for v in match.groups()]
+
+
+def write_fragment(path, node, profiler=None):
+    """ Writes a node (and its children) to the file path, unless the file
+    already has exactly that content, in which case it is left untouched.
+
+    Returns
+    -------
+    written: bool
+        True if the file was replaced
+    """
+    with AtomicWriter(path, only_if_changed=True) as f:
+        node.write(f, profiler)
+    return f.replaced
+
+
 class Report(object):
-    """Class to generate a tex report. Writes to an open tex file. Has methods
-    to conveniently add elements.
+    """Class to generate a tex report. Has methods to conveniently add
+    elements. The elements are collected in a document tree (the attribute
+    `document`), which is written to the tex file when the report is closed.
 
     """
+    latex_command = ('pdflatex', '-interaction=nonstopmode', '-halt-on-error')
 
     def __init__(self, fname, working_dir, pagesize='a4paper',
             orientation='portrait', fontsize=10, author='', title='',
@@ -392,42 +1917,66 @@ class Report(object):
         self.fname = os.path.join(self.working_dir, fname)
         self.orientation = orientation
         self.pagesize = pagesize
-        self.left = Length(left) 
-        self.right = Length(right)
-        self.top = Length(top) 
-        self.bottom = Length(bottom)
-        self.f = open(self.fname, 'w')
-        self.f.write(Template.head.substitute(pagesize=pagesize,
+        self.geometry = PageGeometry(pagesize, orientation, left, right, top,
+                bottom)
+        self.left = self.geometry.left
+        self.right = self.geometry.right
+        self.top = self.geometry.top
+        self.bottom = self.geometry.bottom
+        self.head = (Template.head.substitute(pagesize=pagesize,
             orientation=orientation, fontsize=fontsize, title=title,
             author=author, date=date.strftime('%d.%m.%Y'), left=left,
             right=right, top=top, bottom=bottom))
+        self.document = Node()
+        self._sections = list()
+        self.closed = False
+        self.fragments = False
+        self.includeonly = None
+        self.fragment_names = list()
         self.force_all = False
+        self.evict_orphans = False
+        self.cache = FigureCache(self.figure_dir,
+                os.path.splitext(os.path.basename(self.fname))[0])
+        self.deferred = False
+        self.processes = None
+        self.pending = list()
+        self.format_dir = None
+        self.compiler = None
+        self.raster_threshold = 100000
+        self.measure_plots = False
+        self.plot_stats = dict()
+        self.store = None
+        self.profiler = NullProfiler()
+        self.flush_size = 1 << 16
+        self.compress = False
+        self.close_figures = True
+        self.max_figures = None
+        self._memory = dict(max_figures=0, closed_figures=0,
+                max_rss_by_pid=dict())
+        self.depends = set()
+        self.parts = None
+        self.part_names = list()
+        self._part_heads = dict()
+        self.pdf_merger = merge_pdfs
+        self.draft = False
+        self.tex_cache = None
+        self._tex = dict(hits=0, misses=0)
+        self.resume = False
+        self.keep_journal = False
+        self.journal = None
+        self._journal_plots = dict()
+        # the file `watch` reads the data files from, None if not watched
+        self.watch_file = os.environ.get('PYREPORTER_WATCH')
 
     def get_textwidth_pt(self):
         """Get the textwidth of the doc in pt. 
         """
-        left = self.left.get_value_in('pt')
-        right = self.right.get_value_in('pt')
-        if self.orientation == 'portrait':
-            paper_witdh = Length(papersizes_wh_cm[self.pagesize][0],'cm')
-        elif self.orientation == 'landsacpe':
-            paper_witdh = Length(papersizes_wh_cm[self.pagesize][1],'cm')
-        else:
-            raise Exception('Unknown page orientation: %s' % self.orientation)
-        return paper_witdh.get_value_in('pt') - left - right 
+        return self.geometry.textwidth.value
 
     def get_textheight_pt(self):
-        """Get the textwidth of the doc in pt. 
+        """Get the textheight of the doc in pt. 
         """
-        top = self.top.get_value_in('pt')
-        bottom = self.bottom.get_value_in('pt')
-        if self.orientation == 'portrait':
-            paper_height = Length(papersizes_wh_cm[self.pagesize][1],'cm')
-        elif self.orientation == 'landsacpe':
-            paper_height = Length(papersizes_wh_cm[self.pagesize][0],'cm')
-        else:
-            raise Exception('Unknown page orientation: %s' % self.orientation)
-        return paper_height.get_value_in('pt') - top - bottom 
+        return self.geometry.textheight.value
 
 #    def add_preamble(self, preamble):
 #        """ NOT IMPLEMENTED"""
@@ -435,7 +1984,7 @@ class Report(object):
     
     def make_plot(self, fig, widthratio=None, heightratio=None, width=None,
             height=None, frmt='pdf', name=None, force=False, after_plotting=
-            lambda: None, **kwargs):
+            lambda: None, key=None, args=(), depends=(), **kwargs):
         """ Dumps a matplotlib figure to disk and creates the corresponding tex
         block.
 
@@ -447,6 +1996,22 @@ class Report(object):
         functionality, especially in combination with defining a generator,
         which is then allows to only build the graph if required.
 
+        If a key or generator arguments are given, the figure is cached by its
+        content instead: it is only rendered again if the generator, the key,
+        the arguments, the target size, the format or the active rcParams
+        changed since it was last saved (see `FigureCache`). The generator is
+        identified by its name only, change the key after editing its code
+        (or use watch mode, which covers the code).
+
+        If the attribute `store` is set to a `FigureStore`, cached figures
+        are looked up there before they are rendered, and added to it after.
+
+        Artists with more points than the attribute `raster_threshold` are
+        decimated or rasterized before saving (see `simplify_figure`). Set it
+        to None to disable this. If the attribute `measure_plots` is True, the
+        size the file would have had without this is measured as well. The
+        statistics are collected in the attribute `plot_stats` by name.
+
         Parameters
         ----------
         fig: a matplotlib.Figure or a callable 
@@ -471,105 +2036,367 @@ class Report(object):
         after_plotting: callable, optional
             A function which will be executed after plotting. This could for
             instance be used to close figures after plotting
+        key: object, optional
+            A key identifying the content of the figure, e.g. a tuple of the
+            parameters the generator depends on. It needs a stable repr.
+            Default: None
+        args: tuple, optional
+            Arguments that are passed to the generator `fig`. They are part of
+            the cache key. Default: ()
+        depends: list of str, optional
+            Data files the figure is made from. Their contents are part of the
+            cache key and they are watched in watch mode (see `watch`).
+            Default: ()
         """
-        # build the filename
-        name = ''.join([rnd.choice(string.ascii_letters) for _ in range(30)]) \
-                if name is None else name
-        filename = os.path.join(self.figure_dir, name + '.' + frmt.strip(' .'))
+        return self.plot_node(fig, widthratio=widthratio,
+            heightratio=heightratio, width=width, height=height, frmt=frmt,
+            name=name, force=force, after_plotting=after_plotting, key=key,
+            args=args, depends=depends, **kwargs).tex()
+
+    def plot_node(self, fig, widthratio=None, heightratio=None, width=None,
+            height=None, frmt='pdf', name=None, force=False, after_plotting=
+            lambda: None, key=None, args=(), depends=(), **kwargs):
+        """ Like make_plot, but returns a Figure node instead of the tex
+        block
+        """
+        with self.profiler.span('make_plot', name or 'plot'):
+            return self._plot_node(fig, widthratio=widthratio,
+                heightratio=heightratio, width=width, height=height,
+                frmt=frmt, name=name, force=force,
+                after_plotting=after_plotting, key=key, args=args,
+                depends=depends, **kwargs)
+
+    def _plot_node(self, fig, widthratio, heightratio, width, height, frmt,
+            name, force, after_plotting, key, args, depends, **kwargs):
+        name, filename, dimension, target, digest, render = self._plot_plan(
+                fig, widthratio, heightratio, width, height, frmt, name, force,
+                key, args, depends)
+        if render:
+            job = dict(fig=fig, filename=filename, dimension=dimension,
+                    target=target, args=args,
+                    raster_threshold=self.raster_threshold,
+                    measure=self.measure_plots, close=self.close_figures,
+                    max_figures=self.max_figures, draft=self.draft,
+                    tex_cache=self.tex_cache)
+            if self.deferred and hasattr(fig, '__call__'):
+                import matplotlib
+                job['rc'] = dict((k, v) for k, v in
+                        matplotlib.rcParams.items() if k != 'backend')
+                self.pending.append((name, job, digest, after_plotting))
+            else:
+                self._record_plot(name, render_figure(**job))
+                self._rendered(filename, digest)
+                after_plotting()
+
+        return Figure(name, filename, Template.figure(dimension=dimension,
+                size=str(target), fname=filename, **kwargs))
+
+    def _plot_plan(self, fig, widthratio, heightratio, width, height, frmt,
+            name, force, key, args, depends):
+        """ Works out the size, the file and the cache key of a plot and
+        whether it has to be rendered. Returns (name, filename, dimension,
+        target, digest, render), the digest is None for plots that are not
+        cached.
+
+        In watch mode (the attribute `watch_file` is set, see `watch`),
+        force_all is ignored, figure objects are always saved and all plots
+        from generators are cached, including the code of the generator. The
+        code is also covered if the report uses a `FigureStore`. When the
+        report resumes from a journal, the figures in the journal are reused
+        unless force is True.
+        """
+        frmt = frmt.strip(' .')
         # check if and how we need to specify the size of the figure
         lornone = lambda x: None if x is None else Length(x)
         values = [widthratio, heightratio, lornone(width), lornone(height)]
         dims = ['width', 'height', 'width', 'height']
-        factors = [lambda: Length(self.get_textwidth_pt(),'pt'), 
-                lambda: Length(self.get_textheight_pt(),'pt')] + [lambda: 1]*2
+        factors = [lambda: self.geometry.textwidth,
+                lambda: self.geometry.textheight, lambda: 1, lambda: 1]
         #make sure that we only have one specification
         temp = [x is not None for x in values]
         assert(sum(temp)==1), \
                 "you have to provide exactly one size specification"
         idx = temp.index(True)
-        methods = [r'{}', r'{}', r'{}', r'{}']
+        target = values[idx]*factors[idx]()
+        depends = [os.path.abspath(p) for p in depends]
+        self.depends.update(depends)
+        watching = self.watch_file is not None
+        generated = hasattr(fig, '__call__')
+        journal = self._journal()
+        if journal is not None:
+            with _draft_context(self.draft):
+                plot = journal.next_plot(figure_digest((name, key), args,
+                    dims[idx], target, frmt, depends,
+                    code_digest(fig) if generated else None))
+            replay = None if force else journal.figure(plot)
+            if replay is not None:
+                self.cache.touch(replay[1])
+                return replay[0], replay[1], dims[idx], target, None, False
+        cached = key is not None or len(args) > 0 or len(depends) > 0 or \
+                (watching and generated)
+        digest = None
+        if cached:
+            # drafts differ in their rcParams and therefore in their digest
+            with _draft_context(self.draft):
+                code = generated and (watching or self.store is not None)
+                digest = figure_digest(key, args, dims[idx], target, frmt,
+                        depends, code_digest(fig) if code else None,
+                        generator_name(fig) if generated else None)
+        # build the filename
+        if name is None:
+            name = 'fig-' + digest[:16] if cached else ''.join(
+                    [rnd.choice(string.ascii_letters) for _ in range(30)])
+        filename = os.path.join(self.figure_dir, name + '.' + frmt)
+        if journal is not None:
+            self._journal_plots[filename] = (plot, name)
         # check if we need to save the plot
-        if (not os.path.exists(filename)) or force or self.force_all:
-            if hasattr(fig, '__call__'):
-                fig = fig()
-            print "writing plot:", filename
-            fsize = [i.item() for i in fig.get_size_inches()]
-            target = values[idx]*factors[idx]()
-            target.dpi = 0.9*72.# fig.get_dpi() #slightly smaller to account
-                                # for slightly heavier fonts compared to latex
-            if dims[idx] == 'width':
-                scale = target.convert_to('in').value / fsize[0]
-            else:
-                scale = target.convert_to('in').value / fsize[1]
-            fig.set_size_inches(*[i*scale for i in fsize], forward=True)
-            fig.gca().relim()
-            fig.savefig(filename)
-            after_plotting()
+        if force or (self.force_all and not watching) or \
+                (watching and not generated):
+            render = True
+        elif cached:
+            render = not self.cache.lookup(filename, digest)
+            if render and self.store is not None and \
+                    self.store.fetch(digest, filename):
+                self.cache.store(filename, digest)
+                render = False
+        else:
+            render = not os.path.exists(filename) or self.draft != (
+                    self.cache.entries.get(os.path.basename(filename)) ==
+                    'draft')
+        self.cache.touch(filename)
+        return name, filename, dims[idx], target, digest, render
+
+
+    def memory_stats(self):
+        """ Returns the peak memory use while the plots of this report were
+        rendered: the most open pyplot figures after a plot was saved
+        ('max_figures'), the number of figures the report closed
+        ('closed_figures') and the peak resident memory in bytes of the
+        processes that rendered plots ('max_rss', by process in
+        'max_rss_by_pid', not available on windows).
+
+        Figures are closed after saving if they were created by a generator
+        and the attribute `close_figures` is True (the default). The
+        attribute `max_figures` limits the number of open figures, see
+        `limit_figures`. Generators can reuse figures with `pooled_figure`.
+        """
+        result = dict(self._memory)
+        result['max_rss_by_pid'] = dict(self._memory['max_rss_by_pid'])
+        if result['max_rss_by_pid']:
+            result['max_rss'] = max(result['max_rss_by_pid'].values())
+        return result
+
+    def cache_summary(self):
+        """ Returns a line with the hits and misses of the figure cache and of
+        the usetex cache while plotting.
+
+        Set the attribute `tex_cache` to a directory to keep the text that
+        matplotlib typesets with latex there, to share it between processes
+        and runs (see `use_tex_cache`). If the attribute `draft` is True,
+        figures are rendered with mathtext instead of latex (see
+        `draft_rc`). Drafts are cached separately and rendered again once
+        draft is False.
+        """
+        def rate(hits, misses):
+            total = hits + misses
+            return '{} hits, {} misses ({:.0f}% hit rate)'.format(hits, misses,
+                    100. * hits / total if total else 0.)
+        return 'figure cache: {}; tex cache: {}'.format(
+                rate(self.cache.hits, self.cache.misses),
+                rate(self._tex['hits'], self._tex['misses']))
+
+    def _record_plot(self, name, stats):
+        """ Records the stats of a rendered plot (see `render_figure`)
+        """
+        self.plot_stats[name] = stats
+        self.profiler.record_plot(name, stats)
+        memory = self._memory
+        memory['max_figures'] = max(memory['max_figures'],
+                stats.get('figures', 0))
+        memory['closed_figures'] += stats.get('closed_figures', 0)
+        self._tex['hits'] += stats.get('tex_hits', 0)
+        self._tex['misses'] += stats.get('tex_misses', 0)
+        if 'max_rss' in stats:
+            by_pid = memory['max_rss_by_pid']
+            by_pid[stats['pid']] = max(by_pid.get(stats['pid'], 0),
+                    stats['max_rss'])
+
+    def _rendered(self, filename, digest):
+        """ Records a figure that was rendered from digest in the cache and
+        the store. For figures that are not cached (digest is None), the
+        cache only remembers if they are drafts. The figure is recorded in the
+        journal if the report keeps one.
+        """
+        if filename in self._journal_plots:
+            plot, name = self._journal_plots.pop(filename)
+            self.journal.rendered(plot, name, filename)
+        if digest is None:
+            self.cache.store(filename, 'draft' if self.draft else None)
+            return
+        self.cache.store(filename, digest)
+        if self.store is not None:
+            self.store.put(digest, filename)
+
+    def render_pending(self):
+        """ Renders the figures that were deferred by make_plot.
+
+        If the attribute `deferred` is True, make_plot only records the
+        generators of the figures that need to be rendered. This function
+        renders them in a pool of `processes` worker processes (Default: the
+        number of cores). The generators and their arguments therefore need to
+        be picklable (e.g. module level functions, but no lambdas). Each worker
+        uses the rcParams that were active when the plot was added.
+
+        Raises a FigureError with the names of all figures that failed.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        if not self.pending:
+            return
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            self._collect_pending(self._submit_pending(pool))
+
+    def _submit_pending(self, pool):
+        """ Submits the deferred figures to pool and returns the jobs with
+        their futures
+        """
+        jobs, self.pending = self.pending, list()
+        return [(job, pool.submit(render_figure, **job[1])) for job in jobs]
 
-        return Template.figure(dimension=dims[idx],
-                size=methods[idx].format(str(values[idx]*factors[idx]())),
-                fname=filename,**kwargs)
+    def _collect_pending(self, futures):
+        """ Waits for the futures of `_submit_pending` and records the
+        figures. Raises a FigureError if any of them failed.
+        """
+        failures = dict()
+        for (name, job, digest, after_plotting), future in futures:
+            try:
+                self._record_plot(name, future.result())
+            except Exception as e:
+                failures[name] = e
+                continue
+            self._rendered(job['filename'], digest)
+            after_plotting()
+        if failures:
+            raise FigureError(failures)
 
+    def _journal(self):
+        """ Returns the journal of the report if the attribute `resume` is
+        True, opening it on first use
+        """
+        if self.resume and self.journal is None:
+            self.journal = Journal(os.path.splitext(self.fname)[0] +
+                    '.journal')
+            if self.journal.nodes:
+                print('resuming from {} elements and {} figures in {}'.format(
+                    len(self.journal.nodes), len(self.journal.figures),
+                    self.journal.path))
+        return self.journal
+
+    def append(self, node):
+        """ Appends a node to the document tree. Sections are nested by their
+        level, all other nodes go into the innermost open section. The node
+        is recorded in the journal if the report keeps one.
+        """
+        journal = self._journal()
+        if journal is not None:
+            journal.node(node)
+        if isinstance(node, Section):
+            while self._sections and self._sections[-1].level >= node.level:
+                self._sections.pop()
+        parent = self._sections[-1] if self._sections else self.document
+        parent.children.append(node)
+        if isinstance(node, Section):
+            self._sections.append(node)
+        return node
 
     def add_plot(self, fig, widthratio=None, heightratio=None, width=None,
             height=None, frmt='pdf', name=None, force=False,
-            after_plotting=lambda: None, **kwargs):
+            after_plotting=lambda: None, key=None, args=(), depends=(),
+            **kwargs):
         """ Add a matplotlib plot to the report.
 
-        This function wraps the 'make_plot' function and saves the result to
-        the tex file.
+        This function wraps the 'make_plot' function and adds the result to
+        the report. If the attribute `deferred` is True, generators are only
+        called when the report is closed (see `render_pending`).
             
         See documentation of make_plot for parameter descriptions.
         """
-        self.f.write(self.make_plot(fig, widthratio=widthratio,
+        self.append(self.plot_node(fig, widthratio=widthratio,
             heightratio=heightratio, width=width, height=height, frmt=frmt,
-            name=name, force=force, after_plotting=after_plotting, **kwargs))
+            name=name, force=force, after_plotting=after_plotting, key=key,
+            args=args, depends=depends, **kwargs))
 
     def add_equation(self, content):
         """Adds an equation to the report.
         
         Wraps make_equation.
         """
-        self.f.write(make_equation(content=content))
+        self.append(Equation(content))
 
 
-    def add_table(self, data, cols=None, header=None, **kwargs):
+    def add_table(self, data, cols=None, header=None, formats=None,
+            **kwargs):
         """Adds a table to the report.
         
-        Wraps make_table.
+        Wraps make_table. The data is converted when the report is written;
+        lists are copied, but arrays and DataFrames must not be changed until
+        then.
         """
-        self.f.write(make_table(data, cols=cols, header=header, **kwargs))
+        self.append(Table(data, cols=cols, header=header, formats=formats,
+            **kwargs))
+
+    def add_table_stream(self, rows, cols=None, header=None, formats=None,
+            caption=None, threshold=500, chunksize=1000, **kwargs):
+        """Adds a table from an iterable of rows without holding it in memory.
 
+        The rows are read when the report is written. The first `threshold`
+        rows are buffered. If there are no more rows, the table is written
+        like with add_table. Otherwise a longtable is written, which breaks
+        across pages and repeats the header on every page, and the rows are
+        converted (see `table_rows`) and written in chunks of `chunksize`
+        rows as they come in. An empty table is sized by cols or the header
+        and left out if neither is given.
+
+        Parameters
+        ----------
+        rows: iterable
+            Any iterable (e.g. a generator) of rows
+        threshold: int, optional
+            The number of rows above which a longtable is used. Default: 500
+        chunksize: int, optional
+            The number of rows that are converted and written at once.
+            Default: 1000
+
+        See make_table for the other parameters.
+        """
+        self.append(TableStream(rows, cols=cols, header=header,
+            formats=formats, caption=caption, threshold=threshold,
+            chunksize=chunksize, **kwargs))
 
     def add_section(self, title, newpage=False, starred=False):
         """Adds a section to the report.
         
         Wraps make_section.
         """
-        self.f.write(make_section(title=title, newpage=newpage, 
-            starred=starred))
+        self.append(Section(title, 0, newpage=newpage, starred=starred))
 
     def add_subsection(self, title, newpage=False, starred=False):
         """Adds a subsection to the report.
         
         Wraps make_subsection.
         """
-        self.f.write(make_subsection(title=title, newpage=newpage, 
-            starred=starred))
+        self.append(Section(title, 1, newpage=newpage, starred=starred))
 
     def add_subsubsection(self, title, newpage=False, starred=False):
         """Adds a subsubsection to the report.
         
         Wraps make_subsubsection.
         """
-        self.f.write(make_subsubsection(title=title, newpage=newpage, 
-            starred=starred))
+        self.append(Section(title, 2, newpage=newpage, starred=starred))
 
     def add_text(self, text):
         """ Add simple text to the document
         """
-        self.f.write(text)
-        self.f.write('\n')
+        self.append(Text(text + '\n'))
 
     def add(self, stuff):
         """ Add variable things to the report. 
@@ -580,29 +2407,1406 @@ class Report(object):
         """
 
         if type(stuff) is str:
-            self.f.write(stuff)
-            if not stuff.endswith('\n'):
-                self.f.write('\n')
+            self.append(Text(stuff if stuff.endswith('\n') else stuff + '\n'))
         else: #assume list of strings
-            self.f.write('\n'.join(stuff))
-            self.f.write('\n')
-
-
-    def close(self, build=False):
+            self.append(Text('\n'.join(stuff) + '\n'))
+
+    def write(self):
+        """ Writes the document tree to the tex file.
+
+        If the attribute `fragments` is True, each top level section is
+        written to its own file in the working directory (named after the
+        report and the number of the section), which is included by the main
+        file with \\include. A fragment file is only replaced if its content
+        changed. The attribute `includeonly` can be set to a list of section
+        numbers (starting at 0) or titles, to only compile these sections;
+        the page numbers and references of the others are kept by latex.
+
+        The file is written in blocks of `flush_size` bytes to a
+        temporary file, which replaces the tex file when it is complete. If
+        the attribute `compress` is True, the tex file is gzip compressed
+        (fname.gz) and only expanded for the build.
+
+        If the attribute `parts` is set to a number, the report is only
+        written as that many separate documents (see `write_parts`), which
+        are built in parallel and merged (see `build_parts`).
+        """
+        if self.parts:
+            self.write_parts()
+            return
+        fname = self.fname + '.gz' if self.compress else self.fname
+        if not self.fragments:
+            with AtomicWriter(fname, self.flush_size, self.compress) as f:
+                f.write(self.head)
+                self.document.write(f, self.profiler)
+                f.write(Template.tail)
+            return
+        base = os.path.splitext(os.path.basename(self.fname))[0]
+        sections = [n for n in self.document.children
+                if isinstance(n, Section) and n.level == 0]
+        self.fragment_names = ['{}-sec{:02d}'.format(base, i + 1)
+                for i in range(len(sections))]
+        names = dict(zip(map(id, sections), self.fragment_names))
+        head = self.head
+        if self.includeonly is not None:
+            only = [self.fragment_names[i] if isinstance(i, int) else
+                    names[id([n for n in sections if n.title == i][0])]
+                    for i in self.includeonly]
+            head = head.replace(r'\begin{document}', r'\includeonly{%s}' %
+                    ','.join(only) + '\n' + r'\begin{document}', 1)
+        with AtomicWriter(fname, self.flush_size, self.compress) as f:
+            f.write(head)
+            for node in self.document.children:
+                if id(node) in names:
+                    write_fragment(os.path.join(self.working_dir,
+                        names[id(node)] + '.tex'), node, self.profiler)
+                    f.write('\n\\include{%s}\n' % names[id(node)])
+                else:
+                    node.write(f, self.profiler)
+            f.write(Template.tail)
+        # remove fragments of sections that do not exist anymore
+        pattern = re.compile(re.escape(base) + r'-sec\d{2,}\.tex$')
+        for name in os.listdir(self.working_dir):
+            if pattern.match(name) and name[:-4] not in names.values():
+                os.remove(os.path.join(self.working_dir, name))
+
+    def _split_parts(self):
+        """ Splits the top level nodes at the top level sections into at most
+        `parts` consecutive groups with about the same number of elements.
+        """
+        chunks = list()
+        for node in self.document.children:
+            if not chunks or (isinstance(node, Section) and node.level == 0
+                    and any(isinstance(n, Section) for n in chunks[-1])):
+                chunks.append(list())
+            chunks[-1].append(node)
+        weights = [sum(1 for n in chunk for _ in n.walk()) for chunk in chunks]
+        total = float(sum(weights))
+        groups, done = [list()], 0
+        for chunk, weight in zip(chunks, weights):
+            if groups[-1] and len(groups) < self.parts and \
+                    done >= total * len(groups) / self.parts:
+                groups.append(list())
+            groups[-1].extend(chunk)
+            done += weight
+        return groups
+
+    def write_parts(self, starts=None):
+        """ Writes the report as `parts` separate documents (named after the
+        report and the number of the part), split at top level sections.
+        They share the head of the report and start with the page, section,
+        figure, table and equation numbers at which the previous part ended.
+        These are taken from the last build. A part file is only replaced if
+        its content changed.
+
+        If starts (a dict by part name) is given, the parts that were written
+        before only get these start numbers: the document tree is written
+        once, as streamed tables (see `add_table_stream`) can only be read
+        once.
+        """
+        base = os.path.splitext(self.fname)[0]
+        if starts is not None:
+            for name in self.part_names:
+                self._write_part_head(name, starts.get(name,
+                    [1, 0, 0, 0, 0]))
+            return
+        starts = dict()
+        if os.path.exists(base + '-parts.json'):
+            with open(base + '-parts.json') as f:
+                starts = json.load(f)
+        groups = self._split_parts()
+        self.part_names = ['{}-part{:02d}'.format(os.path.basename(base),
+            i + 1) for i in range(len(groups))]
+        head = self.head.replace(r'\begin{document}',
+                '\\providecommand{\\pyreportercounters}[5]{}\n' +
+                r'\begin{document}', 1)
+        self._part_heads = dict()
+        for i, (name, nodes) in enumerate(zip(self.part_names, groups)):
+            part_head = head if i == 0 else \
+                    head.replace('\\maketitle\n', '', 1)
+            part_head += _part_start(starts.get(name, [1, 0, 0, 0, 0]))
+            self._part_heads[name] = part_head
+            with AtomicWriter(os.path.join(self.working_dir, name + '.tex'),
+                    self.flush_size, only_if_changed=True) as f:
+                f.write(part_head)
+                for node in nodes:
+                    node.write(f, self.profiler)
+                f.write(_part_tail + Template.tail)
+        # remove parts that do not exist anymore
+        pattern = re.compile(re.escape(os.path.basename(base)) +
+                r'-part\d{2,}\.tex$')
+        for name in os.listdir(self.working_dir):
+            if pattern.match(name) and name[:-4] not in self.part_names:
+                os.remove(os.path.join(self.working_dir, name))
+
+    def _write_part_head(self, name, start):
+        """ Replaces the start numbers of a part that was written by
+        write_parts, copying the rest of the file
+        """
+        import shutil
+        head = self._part_heads[name]
+        new = head[:head.rindex('\\setcounter{page}')] + _part_start(start)
+        if new == head:
+            return
+        path = os.path.join(self.working_dir, name + '.tex')
+        with open(path, encoding='utf-8') as src:
+            if src.read(len(head)) != head:
+                raise Exception('{} was changed after it was '
+                        'written'.format(path))
+            with AtomicWriter(path, self.flush_size) as f:
+                f.write(new)
+                shutil.copyfileobj(src, f, self.flush_size)
+        self._part_heads[name] = new
+
+    def build_parts(self, timeout=600, max_passes=5, force=False):
+        """ Builds the parts written by `write_parts` in parallel (with
+        `processes` threads, Default: the number of cores) and merges them
+        into the pdf of the report with the attribute `pdf_merger`
+        (Default: `merge_pdfs`).
+
+        The numbers a part ends with are only known after it was built. Parts
+        whose start numbers changed are written and built again, which
+        usually takes a second round the first time. The numbers are kept in
+        a json file next to the report for the following builds. References
+        between parts are not resolved.
+
+        Returns
+        -------
+        result: dict
+            'status' ('ok', 'skipped' or the status of the first failed
+            part), the total number of latex 'passes', the 'time', the number
+            of 'rounds', the results of the parts (see `build_tex`) in 'parts'
+            and whether the pdf was 'merged'
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        t = time.time()
+        base = os.path.splitext(self.fname)[0]
+        paths = [os.path.join(self.working_dir, n + '.tex')
+                for n in self.part_names]
+        starts = dict()
+        if os.path.exists(base + '-parts.json'):
+            with open(base + '-parts.json') as f:
+                starts = json.load(f)
+        results = [None] * len(paths)
+        passes, rounds, todo = 0, 0, list(range(len(paths)))
+
+        def build(i):
+            if self.compiler is not None:
+                return self.compiler.build(paths[i], timeout=timeout,
+                        max_passes=max_passes, force=force and rounds == 1)
+            return build_pdf(paths[i], command=self.latex_command,
+                    format_dir=self.format_dir, timeout=timeout,
+                    max_passes=max_passes, force=force and rounds == 1)
+
+        with ThreadPoolExecutor(max_workers=self.processes) as pool:
+            while todo and rounds <= len(paths):
+                rounds += 1
+                for i, result in zip(todo, pool.map(build, todo)):
+                    results[i] = result
+                    passes += result['passes']
+                if any(r['status'] not in ('ok', 'skipped') for r in results):
+                    break
+                ends = [_read_part_counters(p) for p in paths]
+                if None in ends:
+                    break
+                # a part keeps its length when its start moves
+                new, start = dict(), [1, 0, 0, 0, 0]
+                for name, end in zip(self.part_names, ends):
+                    old = starts.get(name, [1, 0, 0, 0, 0])
+                    new[name] = start
+                    start = [start[0] + end[0] - old[0] + 1] + \
+                            [s + e - o for s, e, o in zip(start[1:], end[1:],
+                                old[1:])]
+                todo = [i for i, n in enumerate(self.part_names)
+                        if new[n] != starts.get(n, [1, 0, 0, 0, 0])]
+                starts = new
+                with open(base + '-parts.json', 'w') as f:
+                    json.dump(starts, f)
+                if todo:
+                    self.write_parts(starts)
+        failed = [r['status'] for r in results if r['status'] not in
+                ('ok', 'skipped')]
+        pdfs = [os.path.splitext(p)[0] + '.pdf' for p in paths]
+        merged = False
+        if not failed and (not os.path.exists(base + '.pdf') or
+                any(os.path.getmtime(p) > os.path.getmtime(base + '.pdf')
+                    for p in pdfs)):
+            self.pdf_merger(pdfs, base + '.pdf')
+            merged = True
+        status = failed[0] if failed else 'ok' if merged else 'skipped'
+        return dict(status=status, passes=passes, rounds=rounds,
+                parts=results, merged=merged, time=time.time() - t)
+
+    def close(self, build=False, timeout=600):
         """ Finish the report and close the file
 
         Parameters
         ----------
         build: bool, optional
             If true, pdflatex is called to build the pdf from the tex file.
-            Default: False
+            The build is skipped if neither the tex file nor any of the
+            included figures changed since the last build. Default: False
+        timeout: float, optional
+            Timeout of a single pdflatex pass in seconds. Default: 600
+
+        Returns
+        -------
+        result: dict or None
+            The result of the build (see `build_tex`) if build is True
         """
 
-        self.f.write(Template.tail)
-        self.f.close()
+        with self.profiler.span('report', 'write'):
+            self.write()
+        self.closed = True
+        try:
+            with self.profiler.span('report', 'render_pending'):
+                self.render_pending()
+        finally:
+            if self.evict_orphans:
+                self.cache.evict_orphans()
+            self.cache.save()
+            if self.store is not None and self.store.max_bytes is not None:
+                self.store.gc()
+        if self.journal is not None:
+            # the report is complete, a rerun starts from scratch
+            if self.keep_journal:
+                self.journal.close()
+            else:
+                self.journal.remove()
+        if self.watch_file is not None:
+            # tell the watcher about the data files
+            with open(self.watch_file, 'a') as f:
+                f.write(json.dumps(sorted(self.depends)) + '\n')
+        if self.plot_stats or self.cache.hits or self.cache.misses:
+            print(self.cache_summary())
+        result = None
         if build:
-            os.system('cd %s; pdflatex %s' % (self.working_dir, self.fname))
-    
+            result = self.build(timeout=timeout)
+            self.profiler.record_build(result)
+        if self.profiler.enabled:
+            print(self.profiler.summary())
+            self.profiler.save(os.path.splitext(self.fname)[0] +
+                    '.trace.json')
+        return result
+
+    def build(self, timeout=600, max_passes=5, force=False):
+        """ Builds the pdf from the (closed) tex file.
+
+        See `build_tex`. The command that is used can be changed through the
+        attribute `latex_command`. If the attribute `format_dir` is set, the
+        preamble is precompiled into a format that is cached in that
+        directory (see `make_format`) and reused by subsequent builds. If the
+        attribute `compiler` is set to a CompileServer or CompileClient, the
+        build is done by the server instead. If the attribute `parts` is
+        set, the parts are built and merged instead (see `build_parts`).
+        """
+        if self.parts:
+            return self.build_parts(timeout=timeout, max_passes=max_passes,
+                    force=force)
+        if self.compress:
+            expand_tex(self.fname)
+        if self.compiler is not None:
+            return self.compiler.build(self.fname, timeout=timeout,
+                    max_passes=max_passes, force=force)
+        return build_pdf(self.fname, command=self.latex_command,
+                format_dir=self.format_dir, timeout=timeout,
+                max_passes=max_passes, force=force)
+
+
+class AsyncReport(Report):
+    """ A Report for asyncio programs, whose figure generators wait for data
+    (e.g. from databases or files).
+
+    add_plot returns immediately with an asyncio task and keeps the place of
+    the figure in the document. Generators can be coroutine functions, which
+    are awaited on the event loop, while the figures are saved by
+    `plot_threads` worker threads (Default: 1, matplotlib is not thread
+    safe), so the loop keeps serving the other generators. close is a
+    coroutine that waits for all plots before the report is written.
+    Everything else works like in Report.
+
+    Generators must not use `pooled_figure`, as a pooled figure can be
+    cleared by the next generator while it is saved. With draft, the draft
+    rcParams are applied on the loop from the first plot that is rendered
+    until the last one is saved, so they apply to all figures that are
+    created in between.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Report.__init__(self, *args, **kwargs)
+        self.plot_threads = 1
+        self.tasks = list()
+        self._pool = None
+        self._drafting = 0
+        self._draft = None
+
+    def _enter_draft(self):
+        # rcParams are global, so the draft rc stays applied while any plot
+        # is rendered instead of being entered and left by every plot
+        if not self.draft:
+            return False
+        if self._drafting == 0:
+            self._draft = _draft_context(True)
+            self._draft.__enter__()
+        self._drafting += 1
+        return True
+
+    def _exit_draft(self):
+        self._drafting -= 1
+        if self._drafting == 0:
+            draft, self._draft = self._draft, None
+            draft.__exit__(None, None, None)
+
+    def add_plot(self, fig, widthratio=None, heightratio=None, width=None,
+            height=None, frmt='pdf', name=None, force=False,
+            after_plotting=lambda: None, key=None, args=(), depends=(),
+            **kwargs):
+        """ Adds a plot to the report. fig can also be a coroutine function
+        that returns the figure. Has to be called while the event loop is
+        running.
+
+        See documentation of make_plot for parameter descriptions.
+
+        Returns
+        -------
+        task: asyncio.Task
+            The task that renders the figure, it can be awaited
+        """
+        import asyncio
+        placeholder = self.append(Node())
+        task = asyncio.ensure_future(self._add_plot(placeholder, fig,
+            widthratio, heightratio, width, height, frmt, name, force,
+            after_plotting, key, args, depends, **kwargs))
+        self.tasks.append((name or 'plot {}'.format(len(self.tasks)), task))
+        return task
+
+    async def _add_plot(self, placeholder, fig, widthratio, heightratio,
+            width, height, frmt, name, force, after_plotting, key, args,
+            depends, **kwargs):
+        import asyncio
+        import inspect
+        name, filename, dimension, target, digest, render = self._plot_plan(
+                fig, widthratio, heightratio, width, height, frmt, name, force,
+                key, args, depends)
+        if render:
+            t = time.time()
+            created = hasattr(fig, '__call__')
+            drafting = self._enter_draft()
+            try:
+                if inspect.iscoroutinefunction(fig):
+                    fig = await fig(*args)
+                elif hasattr(fig, '__call__'):
+                    # pyplot keeps global state, so generators run on the loop
+                    fig = fig(*args)
+                generated = time.time() - t
+                if self.draft:
+                    import matplotlib.text
+                    for text in fig.findobj(matplotlib.text.Text):
+                        text.set_usetex(False)
+                plt = sys.modules.get('matplotlib.pyplot')
+                closing = self.close_figures and created and \
+                        plt is not None and not _pooled(fig)
+                if self._pool is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._pool = ThreadPoolExecutor(
+                            max_workers=self.plot_threads)
+                try:
+                    # the draft rc is already applied, the thread must not
+                    # enter (and later restore) rcParams itself
+                    stats = await asyncio.get_event_loop().run_in_executor(
+                            self._pool, functools.partial(render_figure, fig,
+                                filename, dimension, target,
+                                raster_threshold=self.raster_threshold,
+                                measure=self.measure_plots,
+                                tex_cache=self.tex_cache))
+                finally:
+                    # pyplot is only used on the loop
+                    if closing:
+                        plt.close(fig)
+            finally:
+                if drafting:
+                    self._exit_draft()
+            stats['closed_figures'] += int(closing)
+            if self.max_figures is not None:
+                stats['closed_figures'] += limit_figures(self.max_figures)
+            stats.update(memory_usage())
+            stats['timings'].insert(0, ('generator', t, generated))
+            self._record_plot(name, stats)
+            self._rendered(filename, digest)
+            after_plotting()
+        placeholder.children.append(Figure(name, filename, Template.figure(
+            dimension=dimension, size=str(target), fname=filename, **kwargs)))
+
+    async def close(self, build=False, timeout=600):
+        """ Waits for all plots, then writes the report and builds it if
+        build is True (see Report.close). The report is written in a worker
+        thread.
+
+        Raises a FigureError with the names of all figures that failed, after
+        the report was written without them. The report is not built then.
+        """
+        import asyncio
+        tasks, self.tasks = self.tasks, list()
+        results = await asyncio.gather(*[t for _, t in tasks],
+                return_exceptions=True)
+        failures = dict((name, r) for (name, _), r in zip(tasks, results)
+                if isinstance(r, Exception))
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        result = await asyncio.get_event_loop().run_in_executor(None,
+                functools.partial(Report.close, self, build and not failures,
+                    timeout))
+        if failures:
+            raise FigureError(failures)
+        return result
+
+
+def build_pdf(fname, command=Report.latex_command, format_dir=None,
+        timeout=600, max_passes=5, force=False):
+    """ Builds a pdf with `build_tex`, using a precompiled format of the
+    preamble cached in format_dir if that is given (see `make_format`).
+    """
+    env, fmt = None, None
+    if format_dir is not None:
+        fmt = make_format(fname, format_dir, engine=command[0],
+                timeout=timeout)
+    if fmt is not None:
+        command = tuple(command) + ('-fmt=' + fmt,)
+        env = dict(os.environ)
+        env['TEXFORMATS'] = os.path.abspath(format_dir) + os.pathsep
+    result = build_tex(fname, command=command, timeout=timeout,
+            max_passes=max_passes, force=force, env=env)
+    result['format'] = fmt
+    return result
+
+
+def merge_pdfs(paths, output):
+    """ Concatenates the pdf files in paths into output. Uses pypdf (or
+    PyPDF2) if it is installed and the pdfunite or qpdf commands otherwise.
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        try:
+            from PyPDF2 import PdfMerger as PdfWriter
+        except ImportError:
+            PdfWriter = None
+    tmp = output + '.tmp'
+    if PdfWriter is not None:
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        with open(tmp, 'wb') as f:
+            writer.write(f)
+    else:
+        import shutil
+        if shutil.which('pdfunite'):
+            command = ['pdfunite'] + list(paths) + [tmp]
+        elif shutil.which('qpdf'):
+            command = ['qpdf', '--empty', '--pages'] + list(paths) + ['--',
+                    tmp]
+        else:
+            raise Exception('Merging pdfs needs pypdf, pdfunite or qpdf')
+        subprocess.check_call(command)
+    os.replace(tmp, output)
+
+
+def _batch_job(job, timeout, max_passes, force):
+    """ Runs one job of `build_reports` in a worker process. job is either
+    a report building callable or the arguments of build_pdf. Reports in
+    parts (see `Report.build_parts`) are built by the report itself, which
+    is also done for Report objects in the main process.
+    """
+    import traceback
+    start = time.time()
+    result = dict(ok=False, error=None, build=None, render_time=0.)
+    try:
+        if isinstance(job, Report) or hasattr(job, '__call__'):
+            report = job if isinstance(job, Report) else job()
+            result['working_dir'] = report.working_dir
+            if not report.closed:
+                report.close()
+            result['render_time'] = time.time() - start
+            if report.parts:
+                job = report
+            else:
+                if report.compress:
+                    expand_tex(report.fname)
+                job = dict(fname=report.fname, command=report.latex_command,
+                        format_dir=report.format_dir)
+        if isinstance(job, Report):
+            result['build'] = job.build(timeout=timeout,
+                    max_passes=max_passes, force=force)
+        else:
+            result['build'] = build_pdf(timeout=timeout,
+                    max_passes=max_passes, force=force, **job)
+        result['ok'] = result['build']['status'] in ('ok', 'skipped')
+        if not result['ok']:
+            result['error'] = 'latex build {}'.format(
+                    result['build']['status'])
+    except Exception as e:
+        result['error'] = '{!r}\n{}'.format(e, traceback.format_exc())
+    result['time'] = time.time() - start
+    return result
+
+
+def build_reports(reports, processes=None, timeout=600, max_passes=5,
+        force=False, initializer=None, initargs=()):
+    """ Builds many reports concurrently.
+
+    Parameters
+    ----------
+    reports: list or dict
+        Report objects or callables that create a Report (e.g. module level
+        functions or functools.partial objects, which can be pickled). A dict
+        maps names to them, otherwise the names are the indices. The
+        deferred figures (see `Report.render_pending`) of all reports that
+        are still open are rendered in the worker pool, then the reports are
+        closed and compiled in the pool. Figures of reports that are not
+        deferred were already rendered when they were added, so only
+        deferred reports and callables spread their plots over the workers.
+        Callables are run in the worker pool, where the report is created,
+        closed and compiled. Reports have to use distinct working
+        directories.
+    processes: int, optional
+        The number of worker processes. Default: None (number of cores)
+    timeout: float, optional
+        Timeout of a single latex pass in seconds. Default: 600
+    initializer: callable, optional
+        Is called with initargs in every worker process before the first
+        report, e.g. to load data that all reports share (see
+        `Skeleton.build`). Default: None
+
+    See `build_tex` for the other parameters.
+
+    Returns
+    -------
+    result: dict
+        'reports' maps the names to dicts with 'ok', 'error', 'time' (total
+        seconds in the worker), 'render_time' (seconds spent creating and
+        closing the report) and 'build' (see `build_tex`). 'failed' lists the
+        names of failed reports and 'time' is the total wall clock time.
+    """
+    from concurrent.futures import Future, ProcessPoolExecutor
+    start = time.time()
+    items = list(reports.items()) if isinstance(reports, dict) else \
+            list(enumerate(reports))
+    dirs = dict()
+    for name, report in items:
+        if isinstance(report, Report):
+            wd = os.path.abspath(report.working_dir)
+            if wd in dirs:
+                raise Exception('Reports {!r} and {!r} share the working '
+                        'directory {}'.format(dirs[wd], name, wd))
+            dirs[wd] = name
+    results = dict()
+    with ProcessPoolExecutor(max_workers=processes, initializer=initializer,
+            initargs=initargs) as pool:
+        # the deferred figures of all reports go to the pool first
+        plots = dict()
+        for name, report in items:
+            if isinstance(report, Report) and not report.closed:
+                plots[name] = report._submit_pending(pool)
+        futures = list()
+        for name, report in items:
+            if isinstance(report, Report):
+                t = time.time()
+                if name in plots:
+                    report._collect_pending(plots[name])
+                if not report.closed:
+                    report.close()
+                if report.parts:
+                    # the parts are built by threads of this process
+                    render_time = time.time() - t
+                    future = Future()
+                    future.set_result(_batch_job(report, timeout, max_passes,
+                        force))
+                    futures.append((name, render_time, report.working_dir,
+                        future))
+                    continue
+                if report.compress:
+                    expand_tex(report.fname)
+                job = dict(fname=report.fname, command=report.latex_command,
+                        format_dir=report.format_dir)
+                futures.append((name, time.time() - t, report.working_dir,
+                    pool.submit(_batch_job, job, timeout, max_passes, force)))
+            else:
+                futures.append((name, 0., None, pool.submit(_batch_job,
+                    report, timeout, max_passes, force)))
+        for name, render_time, working_dir, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = dict(ok=False, error=repr(e), build=None, time=0.,
+                        render_time=0.)
+            result['render_time'] += render_time
+            result.setdefault('working_dir', working_dir)
+            results[name] = result
+    return dict(reports=results, time=time.time() - start,
+            failed=[name for name, _ in items if not results[name]['ok']])
+
+
+class _StaticSection(Section):
+    """ A section of a Skeleton, whose tex was rendered in advance
+    """
+
+    def __init__(self, title, level, text):
+        Section.__init__(self, title, level)
+        self.text = text
+
+    def tex(self):
+        return self.text
+
+
+class Skeleton(object):
+    """ A report layout that is rendered for many parameter sets.
+
+    The static elements (sections, text, equations and tables with fixed
+    data) are rendered to tex once, when they are added, and shared by all
+    reports. Slots are filled for every parameter set: `add_table_slot` and
+    `add_plot_slot` take functions of the parameters that return the data of a
+    table or the figure, `add_text_slot` a function that returns tex.
+    `report` creates the Report for one parameter set and `build` builds the
+    reports for many of them in a pool of processes.
+
+    kwargs are passed to Report (all arguments except fname and
+    working_dir). Callables among them are called with the parameters, e.g.
+    title=customer_name, where customer_name is a function that returns
+    params['customer']. As `build` pickles the skeleton, these and the slot
+    functions should be module level functions, not lambdas. The attribute
+    `attributes` holds Report attributes that are set on all reports (e.g.
+    latex_command).
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.attributes = dict()
+        self.elements = list()
+
+    def _static(self, tex):
+        # consecutive static elements are joined into one text
+        if self.elements and self.elements[-1][0] == 'tex':
+            tex = self.elements.pop()[1] + tex
+        self.elements.append(('tex', tex))
+
+    def add_section(self, title, newpage=False, starred=False):
+        """ Adds a section, see Report.add_section
+        """
+        self.elements.append(('section', (title, 0, make_section(title,
+            newpage=newpage, starred=starred))))
+
+    def add_subsection(self, title, newpage=False, starred=False):
+        """ Adds a subsection, see Report.add_subsection
+        """
+        self.elements.append(('section', (title, 1, make_subsection(title,
+            newpage=newpage, starred=starred))))
+
+    def add_subsubsection(self, title, newpage=False, starred=False):
+        """ Adds a subsubsection, see Report.add_subsubsection
+        """
+        self.elements.append(('section', (title, 2, make_subsubsection(title,
+            newpage=newpage, starred=starred))))
+
+    def add_text(self, text):
+        """ Adds simple text
+        """
+        self._static(text + '\n')
+
+    def add(self, stuff):
+        """ Adds a string or a list of strings, see Report.add
+        """
+        if type(stuff) is str:
+            self._static(stuff if stuff.endswith('\n') else stuff + '\n')
+        else:
+            self._static('\n'.join(stuff) + '\n')
+
+    def add_equation(self, content):
+        """ Adds an equation, see make_equation
+        """
+        self._static(make_equation(content))
+
+    def add_table(self, data, cols=None, header=None, formats=None,
+            **kwargs):
+        """ Adds a table that is the same in all reports, see make_table
+        """
+        self._static(make_table(data, cols=cols, header=header,
+            formats=formats, **kwargs))
+
+    def add_table_slot(self, f, cols=None, header=None, formats=None,
+            **kwargs):
+        """ Adds a table whose data is returned by f(params).
+
+        See make_table for the other parameters.
+        """
+        self.elements.append(('table', (f, dict(cols=cols, header=header,
+            formats=formats, **kwargs))))
+
+    def add_plot_slot(self, f, args=(), **kwargs):
+        """ Adds a plot whose figure is returned by the generator
+        f(params, *args). The parameters are part of the cache key of the
+        figure (see make_plot), so they should have a stable repr.
+
+        See Report.make_plot for the other parameters.
+        """
+        self.elements.append(('plot', (f, tuple(args), kwargs)))
+
+    def add_text_slot(self, f):
+        """ Adds the tex returned by f(params)
+        """
+        self.elements.append(('text', f))
+
+    def report(self, params, fname, working_dir):
+        """ Creates the report for the parameters params. The report is
+        returned open, so more elements can be added.
+        """
+        kwargs = dict((k, v(params) if hasattr(v, '__call__') else v)
+                for k, v in self.kwargs.items())
+        report = Report(fname, working_dir, **kwargs)
+        for name, value in self.attributes.items():
+            setattr(report, name, value)
+        for kind, content in self.elements:
+            if kind == 'tex':
+                report.append(Text(content))
+            elif kind == 'section':
+                report.append(_StaticSection(*content))
+            elif kind == 'table':
+                f, table_kwargs = content
+                report.append(Table(f(params), **table_kwargs))
+            elif kind == 'plot':
+                f, args, plot_kwargs = content
+                report.add_plot(f, args=(params,) + args, **plot_kwargs)
+            else:
+                report.add(content(params))
+        return report
+
+    def build(self, instances, working_dir, fname='report', processes=None,
+            timeout=600, max_passes=5, force=False):
+        """ Renders and builds the reports for many parameter sets with
+        `build_reports`. The skeleton is sent to every worker process once,
+        so its slot functions have to be picklable (e.g. module level
+        functions).
+
+        Parameters
+        ----------
+        instances: list or dict
+            The parameter sets. A dict maps names to them, otherwise the
+            names are the indices. The report of each instance is written to
+            the subdirectory of working_dir with its name.
+        working_dir: str
+            The directory for the reports
+        fname: str, optional
+            The file name of the reports. Default: 'report'
+
+        See `build_reports` for the other parameters and the result.
+        """
+        import pickle
+        try:
+            pickle.dumps(self)
+        except Exception as err:
+            # fork would not need it, but spawn and forkserver do
+            raise Exception('The skeleton cannot be sent to the worker '
+                'processes, use module level functions instead of lambdas '
+                'or local functions: {}'.format(err))
+        items = instances.items() if isinstance(instances, dict) else \
+                enumerate(instances)
+        jobs = dict((name, functools.partial(_skeleton_report, params, fname,
+            os.path.join(working_dir, str(name)))) for name, params in items)
+        return build_reports(jobs, processes=processes, timeout=timeout,
+                max_passes=max_passes, force=force,
+                initializer=_use_skeleton, initargs=(self,))
+
+
+# the skeleton of the reports that are built by a worker process
+_skeleton = None
+
+def _use_skeleton(skeleton):
+    global _skeleton
+    _skeleton = skeleton
+
+
+def _skeleton_report(params, fname, working_dir):
+    return _skeleton.report(params, fname, working_dir)
+
+
+def file_digest(path):
+    """ Returns the sha1 hex digest of the content of a file
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_includegraphics = re.compile(
+        r'\\includegraphics\s*(?:\[[^\]]*\])?\{([^}]*)\}')
+
+_include = re.compile(r'\\(?:include|input)\s*\{([^}]*)\}')
+
+def tex_fingerprint(fname):
+    """ Computes a digest of a tex file, the tex files it includes (through
+    \\include or \\input) and all the graphics they include. Missing files
+    are part of the fingerprint as well.
+    """
+    h = hashlib.sha1()
+    base = os.path.dirname(fname)
+    todo, seen = [fname], set()
+    while todo:
+        path = todo.pop(0)
+        if path in seen:
+            continue
+        seen.add(path)
+        h.update(path.encode('utf-8'))
+        if not os.path.exists(path):
+            h.update(b'missing')
+            continue
+        h.update(file_digest(path).encode('ascii'))
+        if not path.endswith('.tex'):
+            continue
+        with open(path) as f:
+            content = f.read()
+        todo.extend(os.path.join(base, g) for g in
+                _includegraphics.findall(content))
+        todo.extend(os.path.join(base, t if t.endswith('.tex') else
+            t + '.tex') for t in _include.findall(content))
+    return h.hexdigest()
+
+
+def build_tex(fname, command=('pdflatex', '-interaction=nonstopmode',
+        '-halt-on-error'), timeout=600, max_passes=5, force=False, env=None,
+        runner=None):
+    """ Builds a pdf from a tex file, but only if necessary.
+
+    The tex file and all included graphics are fingerprinted (see
+    `tex_fingerprint`). If the fingerprint matches the one of the last
+    successful build and the pdf exists, nothing is done. Otherwise latex is
+    run in the directory of the tex file until its aux file does not change
+    anymore, at most max_passes times.
+
+    Parameters
+    ----------
+    fname: str
+        The tex file
+    command: sequence, optional
+        The latex command. The filename is appended.
+    timeout: float, optional
+        Timeout of a single latex pass in seconds. Default: 600
+    max_passes: int, optional
+        The maximum number of latex passes. Default: 5
+    force: bool, optional
+        If true, the pdf is built even if nothing changed. Default: False
+    env: dict, optional
+        The environment of the latex process. Default: None (inherited)
+    runner: callable, optional
+        Runs a single latex pass instead of command: runner(fname, timeout)
+        returns the return code and the output (bytes), or raises
+        subprocess.TimeoutExpired. Default: None
+
+    Returns
+    -------
+    result: dict
+        'status' is one of {'skipped', 'ok', 'failed', 'timeout'}, 'passes'
+        the number of latex passes, 'pass_starts' and 'pass_times' their
+        start times and durations, 'time' the
+        total time in seconds, 'returncode' the return code of the last pass
+        and 'output' its output.
+    """
+    start = time.time()
+    working_dir, tex = os.path.split(os.path.abspath(fname))
+    base = os.path.splitext(fname)[0]
+    stamp = base + '.fingerprint'
+    pdf, aux = base + '.pdf', base + '.aux'
+    result = dict(status='skipped', passes=0, pass_times=[], pass_starts=[],
+            returncode=None, output='')
+
+    fingerprint = tex_fingerprint(fname)
+    if not force and os.path.exists(pdf) and os.path.exists(stamp):
+        with open(stamp) as f:
+            if f.read().strip() == fingerprint:
+                result['time'] = time.time() - start
+                return result
+    if os.path.exists(stamp):
+        os.remove(stamp)
+
+    aux_digest = lambda: file_digest(aux) if os.path.exists(aux) else None
+    while result['passes'] < max_passes:
+        before = aux_digest()
+        t = time.time()
+        result['pass_starts'].append(t)
+        try:
+            if runner is None:
+                p = subprocess.run(list(command) + [tex], cwd=working_dir,
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                        stdin=subprocess.DEVNULL, timeout=timeout, env=env)
+                returncode, output = p.returncode, p.stdout
+            else:
+                returncode, output = runner(fname, timeout)
+        except subprocess.TimeoutExpired as e:
+            result['status'] = 'timeout'
+            result['output'] = (e.output or b'').decode('utf-8', 'replace')
+            break
+        finally:
+            result['passes'] += 1
+            result['pass_times'].append(time.time() - t)
+        result['returncode'] = returncode
+        result['output'] = output.decode('utf-8', 'replace')
+        if returncode != 0:
+            result['status'] = 'failed'
+            break
+        result['status'] = 'ok'
+        if aux_digest() == before:
+            break
+
+    if result['status'] == 'ok':
+        with open(stamp, 'w') as f:
+            f.write(fingerprint)
+    result['time'] = time.time() - start
+    return result
+
+
+_endofdump = r'\csname endofdump\endcsname'
+
+def make_format(fname, format_dir, engine='pdflatex', timeout=600):
+    """ Precompiles the preamble of a tex file into a latex format.
+
+    The preamble is everything before the `endofdump` marker of the template
+    head. The format is dumped with the mylatexformat package and cached in
+    format_dir under a name derived from the preamble and the engine, such
+    that it is only created once for each preamble. Latex skips the preamble
+    of the document when it is run with the format (-fmt=name).
+
+    Parameters
+    ----------
+    fname: str
+        The tex file
+    format_dir: str
+        The directory in which formats are cached. It is created if it does
+        not exist.
+    engine: str, optional
+        The latex engine the format is made for. Default: 'pdflatex'
+    timeout: float, optional
+        Timeout in seconds for creating the format. Default: 600
+
+    Returns
+    -------
+    name: str or None
+        The name of the format, or None if the file has no marker or the
+        format could not be created.
+    """
+    with open(fname) as f:
+        content = f.read()
+    if _endofdump not in content:
+        return None
+    preamble = content[:content.index(_endofdump)]
+    key = hashlib.sha1((engine + '\n' + preamble).encode('utf-8'))
+    name = 'pyreporter-' + key.hexdigest()[:16]
+    if os.path.exists(os.path.join(format_dir, name + '.fmt')):
+        return name
+    if not os.path.exists(format_dir):
+        os.makedirs(format_dir)
+    with open(os.path.join(format_dir, name + '.tex'), 'w') as f:
+        f.write(preamble + _endofdump + '\n')
+        f.write('\\begin{document}\n\\end{document}\n')
+    try:
+        subprocess.run([engine, '-ini', '-interaction=nonstopmode',
+            '-jobname=' + name, '&' + engine, 'mylatexformat.ltx', name +
+            '.tex'], cwd=format_dir, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if not os.path.exists(os.path.join(format_dir, name + '.fmt')):
+        return None
+    return name
+
+FAKE_ENGINE = r"""
+import hashlib, os, re, sys, time
+opts = dict(a.lstrip('-').split('=', 1) for a in sys.argv[1:]
+        if a.startswith('-') and '=' in a)
+tex = sys.argv[-1]
+if tex == r'\relax':
+    tex = sys.stdin.readline().strip()[len(r'\input{'):-1]
+    for d in os.environ.get('TEXINPUTS', '').split(os.pathsep):
+        if d and os.path.exists(os.path.join(d, tex)):
+            tex = os.path.join(d, tex)
+            break
+with open(tex, 'rb') as f:
+    content = f.read()
+if b'\\fakeerror' in content:
+    print('! Undefined control sequence.')
+    sys.exit(1)
+time.sleep(float(os.environ.get('FAKE_ENGINE_DELAY', 0)) * len(content) / 1e6)
+job = opts.get('jobname', os.path.splitext(os.path.basename(tex))[0])
+base = os.path.join(opts.get('output-directory', '.'), job)
+aux = hashlib.sha1(content).hexdigest()
+if b'pyreportercounters' in content:
+    # a part of a report, pretend there is a page per 4000 characters
+    start = dict(re.findall(r'\\setcounter\{(\w+)\}\{(\d+)\}',
+        content.decode('utf-8')))
+    ends = [int(start.get('page', 1)) + max(1, len(content) // 4000) - 1]
+    for counter, env in [('section', b'\\section{'),
+            ('figure', b'\\includegraphics'), ('table', b'\\begin{tabular}'),
+            ('equation', b'\\begin{equation}')]:
+        ends.append(int(start.get(counter, 0)) + content.count(env))
+    aux += '\n\\pyreportercounters' + ''.join('{%d}' % v for v in ends)
+with open(base + '.aux', 'w') as f:
+    f.write(aux)
+with open(base + '.pdf', 'wb') as f:
+    f.write(b'%PDF-1.4 fake\n' + content)
+print('Output written on {}.pdf'.format(base))
+"""
+
+def fake_engine_command():
+    """ Returns a command that can be used instead of pdflatex in tests and
+    benchmarks (e.g. as Report.latex_command or the engine of a
+    CompileServer). The fake engine writes an aux file with a digest of the
+    tex file and a pdf containing the tex source. It fails for documents
+    that contain \\fakeerror. For parts of reports (see
+    `Report.write_parts`) it pretends that there is a page per 4000
+    characters. The environment variable FAKE_ENGINE_DELAY slows it down by
+    that many seconds per MB of tex.
+    """
+    import sys
+    return (sys.executable, '-c', FAKE_ENGINE)
+
+
+class LatexEngine(object):
+    """ A latex process that is started ahead of time and waits for a
+    document. It is started with the first line '\\relax', such that the
+    format is already loaded, and then reads '\\input{file}' from stdin.
+
+    As the working directory of the process is fixed, it works in a scratch
+    directory: A symlink in the TEXINPUTS path points to the directory of the
+    document, the aux files are copied into the output directory before the
+    run and all outputs are moved back after. An engine runs a single pass.
+    """
+
+    def __init__(self, command, scratch):
+        self.scratch = scratch
+        self.src = os.path.join(scratch, 'src')
+        self.out = os.path.join(scratch, 'out')
+        os.makedirs(self.out)
+        env = dict(os.environ)
+        env['TEXINPUTS'] = self.src + os.pathsep + env.get('TEXINPUTS', '')
+        self.process = subprocess.Popen(list(command) + [
+            '-interaction=scrollmode', '-jobname=job', '-output-directory=' +
+            self.out, r'\relax'], cwd=scratch, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, fname, timeout):
+        """ Runs a latex pass over fname. Returns the return code and the
+        output, or raises subprocess.TimeoutExpired.
+        """
+        import shutil
+        working_dir, tex = os.path.split(os.path.abspath(fname))
+        base = os.path.splitext(tex)[0]
+        os.symlink(working_dir, self.src)
+        for name in os.listdir(working_dir):
+            if name.endswith('.aux'):
+                shutil.copyfile(os.path.join(working_dir, name),
+                        os.path.join(self.out, 'job.aux' if name == base +
+                            '.aux' else name))
+        try:
+            output, _ = self.process.communicate(
+                    ('\\input{%s}\n' % tex).encode('utf-8'), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+            raise
+        for name in os.listdir(self.out):
+            target = base + name[3:] if name.startswith('job.') else name
+            shutil.move(os.path.join(self.out, name),
+                    os.path.join(working_dir, target))
+        return self.process.returncode, output
+
+    def close(self):
+        import shutil
+        if self.alive():
+            self.process.kill()
+            self.process.communicate()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+class CompileServer(object):
+    """ A long-lived latex compile service.
+
+    The server keeps `workers` latex processes warm (see `LatexEngine`) and
+    replaces each one after it ran a pass, or if it died while waiting. Jobs
+    wait until an engine is free. Builds are incremental, like `build_tex`.
+    Clients connect through a local socket (see `CompileClient`), or the
+    server is used directly as the `compiler` of a Report. Clients have to
+    know the `authkey` of the server, `client` returns a connected client.
+    """
+
+    def __init__(self, address=None, workers=2, engine=('pdflatex',),
+            authkey=None):
+        """
+        Parameters
+        ----------
+        address: str, optional
+            The path of the unix socket. Default: None (a temporary path,
+            see the attribute `address`)
+        workers: int, optional
+            The number of warm latex processes. Default: 2
+        engine: sequence, optional
+            The latex command, e.g. fake_engine_command() for tests.
+            Default: ('pdflatex',)
+        authkey: bytes, optional
+            The key clients have to authenticate with. Default: None (a
+            random key, see the attribute `authkey`)
+        """
+        import queue
+        import tempfile
+        import threading
+        from multiprocessing.connection import Listener
+        self.engine = tuple(engine)
+        self.authkey = os.urandom(16) if authkey is None else authkey
+        self.listener = Listener(address, authkey=self.authkey)
+        self.address = self.listener.address
+        self.scratch = tempfile.mkdtemp(prefix='pyreporter-engines-')
+        self.engines = queue.Queue()
+        self.restarts = 0
+        self.jobs = 0
+        self._closed = False
+        self._serving = False
+        self._lock = threading.Lock()
+        self._file_locks = dict()
+        for _ in range(workers):
+            self._spawn()
+
+    def _spawn(self):
+        import tempfile
+        self.engines.put(LatexEngine(self.engine,
+            tempfile.mkdtemp(dir=self.scratch)))
+
+    def _run_pass(self, fname, timeout):
+        while True:
+            engine = self.engines.get()
+            if engine.alive():
+                break
+            engine.close()
+            with self._lock:
+                self.restarts += 1
+            self._spawn()
+        try:
+            return engine.run(fname, timeout)
+        finally:
+            engine.close()
+            if not self._closed:
+                self._spawn()
+
+    def build(self, fname, timeout=600, max_passes=5, force=False):
+        """ Builds the pdf of a tex file with the warm engines. Builds of the
+        same file are serialized. See `build_tex` for the parameters and the
+        result.
+        """
+        import threading
+        fname = os.path.abspath(fname)
+        with self._lock:
+            self.jobs += 1
+            lock = self._file_locks.setdefault(fname, threading.Lock())
+        with lock:
+            return build_tex(fname, timeout=timeout, max_passes=max_passes,
+                    force=force, runner=self._run_pass)
+
+    def _handle(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    result = self.build(**request)
+                except Exception as e:
+                    result = dict(status='error', output=repr(e), passes=0,
+                            pass_times=[], pass_starts=[], returncode=None,
+                            time=0.)
+                conn.send(result)
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        """ Accepts clients until the server is closed. Each client is
+        served in its own thread.
+        """
+        import threading
+        self._serving = True
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                continue
+            if self._closed:
+                conn.close()
+                break
+            t = threading.Thread(target=self._handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def client(self):
+        """ Returns a CompileClient for this server
+        """
+        return CompileClient(self.address, self.authkey)
+
+    def start(self):
+        """ Serves in a background thread. Returns the server.
+        """
+        import threading
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def close(self):
+        """ Stops serving and terminates the engines
+        """
+        import shutil
+        from multiprocessing.connection import Client
+        self._closed = True
+        if self._serving:
+            try:
+                # wake up accept
+                Client(self.address, authkey=self.authkey).close()
+            except Exception:
+                pass
+        self.listener.close()
+        while not self.engines.empty():
+            self.engines.get().close()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+class CompileClient(object):
+    """ Connects to a CompileServer with the address and the authkey of the
+    server. Can be used as the `compiler` of a Report.
+    """
+
+    def __init__(self, address, authkey):
+        import threading
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def build(self, fname, timeout=600, max_passes=5, force=False):
+        """ Builds the pdf of a tex file on the server. See `build_tex` for
+        the parameters and the result.
+        """
+        from multiprocessing.connection import Client
+        with self._lock:
+            if self._conn is None:
+                self._conn = Client(self.address, authkey=self.authkey)
+            self._conn.send(dict(fname=os.path.abspath(fname),
+                timeout=timeout, max_passes=max_passes, force=force))
+            return self._conn.recv()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def watch(script, depends=(), interval=0.5, debounce=0.5, runs=None,
+        python=sys.executable):
+    """ Runs a report script again whenever it or its data files change.
+
+    The script runs in watch mode (the reports get the attribute
+    `watch_file`, set it to None to leave watch mode): force_all is ignored,
+    figure objects are always saved and plots are cached by their generator
+    code (see `code_digest`), their arguments and the files they depend on
+    (the `depends` parameter of make_plot), so only the changed plots are
+    rendered again. The build is skipped if neither the tex
+    file nor the figures changed (see `build_tex`). The files passed to
+    depends by the script are watched as well.
+
+    Parameters
+    ----------
+    script: str
+        The report script
+    depends: list of str, optional
+        Additional files to watch. Default: ()
+    interval: float, optional
+        The seconds between checks for changes. Default: 0.5
+    debounce: float, optional
+        A rerun waits until no file changed for this many seconds, so that a
+        series of changes only causes one run. Default: 0.5
+    runs: int, optional
+        Stop after this many runs. Default: None (until interrupted)
+    python: str, optional
+        The python executable. Default: sys.executable
+
+    Returns
+    -------
+    codes: list of int
+        The exit codes of the runs
+    """
+    import tempfile
+    watched = set(os.path.abspath(p) for p in [script] + list(depends))
+
+    def mtimes():
+        return dict((p, os.path.getmtime(p) if os.path.exists(p) else None)
+                for p in watched)
+
+    fd, deps_file = tempfile.mkstemp(prefix='pyreporter-watch-',
+            suffix='.json')
+    os.close(fd)
+    env = dict(os.environ, PYREPORTER_WATCH=deps_file)
+    codes = list()
+    try:
+        while True:
+            open(deps_file, 'w').close()
+            start = time.time()
+            codes.append(subprocess.call([python, script], env=env))
+            with open(deps_file) as f:
+                for line in f:
+                    watched.update(json.loads(line))
+            print('watch: run took %.1fs (exit code %d), watching %d files' %
+                    (time.time() - start, codes[-1], len(watched)))
+            if runs is not None and len(codes) >= runs:
+                return codes
+            seen = mtimes()
+            while mtimes() == seen:
+                time.sleep(interval)
+            # wait for the changes to settle
+            seen = mtimes()
+            while True:
+                time.sleep(debounce)
+                current = mtimes()
+                if current == seen:
+                    break
+                seen = current
+    except KeyboardInterrupt:
+        return codes
+    finally:
+        os.remove(deps_file)
+
+
+def main(argv=None):
+    """ Command line interface: python -m pyreporter watch script.py
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='pyreporter')
+    commands = parser.add_subparsers(dest='command')
+    w = commands.add_parser('watch',
+            help='run a report script again whenever its inputs change')
+    w.add_argument('script')
+    w.add_argument('-d', '--depends', nargs='*', default=[],
+            help='additional files to watch')
+    w.add_argument('--interval', type=float, default=0.5)
+    w.add_argument('--debounce', type=float, default=0.5)
+    args = parser.parse_args(argv)
+    if args.command == 'watch':
+        watch(args.script, args.depends, interval=args.interval,
+                debounce=args.debounce)
+    else:
+        parser.print_help()
+
+
 def bold(s):
     """ Helper function to create bold tex text
     """
@@ -614,3 +3818,5 @@ def italic(s):
     return r' {{\it {}}}'.format(s)
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+
+
+def line(v):
+    """ A small figure that differs by v, for plot generators in the tests
+    """
+    fig = plt.figure(figsize=(4, 3))
+    plt.plot([0, v])
+    return fig
+
+
+def bar(v):
+    """ Like line, but from a different generator
+    """
+    fig = plt.figure(figsize=(4, 3))
+    plt.bar([0, 1], [0, v])
+    return fig
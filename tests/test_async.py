@@ -0,0 +1,39 @@
+import asyncio
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+import pyreporter
+
+
+class Seen(object):
+    usetex = list()
+
+
+async def slow_line(v):
+    await asyncio.sleep(0.01 * v)
+    fig = plt.figure(figsize=(4, 3))
+    await asyncio.sleep(0.01)
+    Seen.usetex.append(matplotlib.rcParams['text.usetex'])
+    plt.plot([0, v])
+    plt.title('$x^{}$'.format(v))
+    return fig
+
+
+def test_draft_rc_applies_to_all_concurrent_plots(tmp_path):
+    async def main():
+        pdf = pyreporter.AsyncReport('report', str(tmp_path))
+        pdf.draft = True
+        pdf.plot_threads = 2
+        for v in range(1, 5):
+            pdf.add_plot(slow_line, widthratio=0.5, args=(v,),
+                    name='f{}'.format(v))
+        await pdf.close()
+        return pdf
+
+    Seen.usetex[:] = []
+    with matplotlib.rc_context({'text.usetex': True}):
+        pdf = asyncio.run(main())
+        assert matplotlib.rcParams['text.usetex']
+    assert Seen.usetex == [False] * 4
+    assert sorted(pdf.plot_stats) == ['f1', 'f2', 'f3', 'f4']
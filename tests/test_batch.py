@@ -0,0 +1,41 @@
+import os
+
+import pyreporter
+from conftest import line
+
+
+def make_report(path, deferred=False):
+    pdf = pyreporter.Report('report', path)
+    pdf.deferred = deferred
+    pdf.latex_command = pyreporter.fake_engine_command()
+    pdf.add_section('Plots')
+    pdf.add_plot(line, widthratio=0.5, args=(1,))
+    return pdf
+
+
+def test_deferred_figures_are_rendered_by_the_pool(tmp_path):
+    reports = dict()
+    for i in range(3):
+        pdf = make_report(str(tmp_path / str(i)), deferred=True)
+        for v in range(2, 4):
+            pdf.add_plot(line, widthratio=0.5, args=(v,), name='v{}'.format(v))
+        reports[i] = pdf
+    result = pyreporter.build_reports(reports, processes=2)
+    assert result['failed'] == []
+    for pdf in reports.values():
+        assert pdf.closed and not pdf.pending
+        pids = set(stats['pid'] for stats in pdf.plot_stats.values())
+        assert pids and os.getpid() not in pids
+        assert os.path.exists(os.path.join(pdf.working_dir, 'figures',
+            'v3.pdf'))
+
+
+def test_callables_are_built_in_the_pool(tmp_path):
+    import functools
+    jobs = [functools.partial(make_report, str(tmp_path / str(i)))
+            for i in range(2)]
+    result = pyreporter.build_reports(jobs, processes=2)
+    assert result['failed'] == []
+    for i in range(2):
+        assert result['reports'][i]['build']['status'] == 'ok'
+        assert os.path.exists(str(tmp_path / str(i) / 'report.pdf'))
@@ -0,0 +1,130 @@
+import os
+
+import pytest
+
+import pyreporter
+
+ENGINE = pyreporter.fake_engine_command()
+
+DOCUMENT = r"""\documentclass{article}
+\begin{document}
+%s
+\end{document}
+"""
+
+
+def write(path, body):
+    with open(str(path), 'w') as f:
+        f.write(DOCUMENT % body)
+    return str(path)
+
+
+def test_build_tex_runs_until_the_aux_file_settles(tmp_path):
+    fname = write(tmp_path / 'doc.tex', 'Hello')
+    result = pyreporter.build_tex(fname, command=ENGINE)
+    assert result['status'] == 'ok'
+    assert result['passes'] == 2
+    assert len(result['pass_times']) == len(result['pass_starts']) == 2
+    assert os.path.exists(str(tmp_path / 'doc.pdf'))
+    assert os.path.exists(str(tmp_path / 'doc.fingerprint'))
+
+
+def test_build_tex_skips_unchanged_documents(tmp_path):
+    fname = write(tmp_path / 'doc.tex', 'Hello')
+    pyreporter.build_tex(fname, command=ENGINE)
+    assert pyreporter.build_tex(fname, command=ENGINE)['status'] == 'skipped'
+    assert pyreporter.build_tex(fname, command=ENGINE,
+            force=True)['status'] == 'ok'
+
+
+@pytest.mark.parametrize('change', ['tex', 'pdf', 'graphics'])
+def test_build_tex_reruns_after_changes(tmp_path, change):
+    graphics = tmp_path / 'plot.pdf'
+    graphics.write_bytes(b'one')
+    fname = write(tmp_path / 'doc.tex', r'\includegraphics{plot.pdf}')
+    pyreporter.build_tex(fname, command=ENGINE)
+    if change == 'tex':
+        write(tmp_path / 'doc.tex', r'\includegraphics{plot.pdf} Hello')
+    elif change == 'pdf':
+        os.remove(str(tmp_path / 'doc.pdf'))
+    else:
+        graphics.write_bytes(b'two')
+    result = pyreporter.build_tex(fname, command=ENGINE)
+    assert result['status'] == 'ok' and result['passes'] >= 1
+
+
+def test_build_tex_reports_failures(tmp_path):
+    fname = write(tmp_path / 'doc.tex', r'\fakeerror')
+    result = pyreporter.build_tex(fname, command=ENGINE)
+    assert result['status'] == 'failed'
+    assert result['passes'] == 1
+    assert 'Undefined control sequence' in result['output']
+    assert not os.path.exists(str(tmp_path / 'doc.fingerprint'))
+    # failed builds are not skipped
+    assert pyreporter.build_tex(fname, command=ENGINE)['status'] == 'failed'
+
+
+def test_build_tex_timeout(tmp_path, monkeypatch):
+    # about 60s per pass
+    monkeypatch.setenv('FAKE_ENGINE_DELAY', '1000000')
+    fname = write(tmp_path / 'doc.tex', 'Hello')
+    result = pyreporter.build_tex(fname, command=ENGINE, timeout=0.5)
+    assert result['status'] == 'timeout'
+    assert result['passes'] == 1
+    assert not os.path.exists(str(tmp_path / 'doc.fingerprint'))
+
+
+@pytest.fixture
+def server():
+    server = pyreporter.CompileServer(workers=2, engine=ENGINE).start()
+    yield server
+    server.close()
+
+
+def test_compile_server_builds_for_clients(tmp_path, server):
+    fname = write(tmp_path / 'doc.tex', 'Hello')
+    client = server.client()
+    try:
+        assert client.build(fname)['status'] == 'ok'
+        assert client.build(fname)['status'] == 'skipped'
+    finally:
+        client.close()
+    assert server.jobs == 2
+    with open(str(tmp_path / 'doc.pdf'), 'rb') as f:
+        assert b'Hello' in f.read()
+
+
+def test_compile_server_needs_the_key(tmp_path, server):
+    from multiprocessing import AuthenticationError
+    assert len(server.authkey) == 16
+    other = pyreporter.CompileServer(workers=1, engine=ENGINE)
+    try:
+        assert other.authkey != server.authkey
+    finally:
+        other.close()
+    client = pyreporter.CompileClient(server.address, b'pyreporter')
+    with pytest.raises(AuthenticationError):
+        client.build(write(tmp_path / 'doc.tex', 'Hello'))
+
+
+def test_compile_server_restarts_dead_engines(tmp_path, server):
+    for engine in list(server.engines.queue):
+        engine.process.kill()
+        engine.process.wait()
+    fname = write(tmp_path / 'doc.tex', 'Hello')
+    assert server.build(fname)['status'] == 'ok'
+    assert server.restarts == 2
+
+
+def test_compile_server_replaces_engines_after_a_timeout(tmp_path,
+        monkeypatch):
+    monkeypatch.setenv('FAKE_ENGINE_DELAY', '1000000')
+    server = pyreporter.CompileServer(workers=1, engine=ENGINE)
+    try:
+        fname = write(tmp_path / 'doc.tex', 'Hello')
+        result = server.build(fname, timeout=0.5)
+        assert result['status'] == 'timeout'
+        engines = list(server.engines.queue)
+        assert len(engines) == 1 and engines[0].alive()
+    finally:
+        server.close()
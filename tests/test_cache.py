@@ -0,0 +1,56 @@
+import json
+import os
+
+import pyreporter
+from conftest import bar, line
+
+
+def test_cached_figure_is_not_rendered_again(tmp_path):
+    for hits in [0, 1]:
+        pdf = pyreporter.Report('a', str(tmp_path))
+        pdf.add_plot(line, widthratio=0.5, args=(1,), name='f')
+        pdf.close()
+        assert pdf.cache.hits == hits
+
+
+def test_other_generator_is_rendered_again(tmp_path):
+    for gen, hits in [(line, 0), (bar, 0), (bar, 1)]:
+        pdf = pyreporter.Report('a', str(tmp_path))
+        pdf.add_plot(gen, widthratio=0.5, args=(1,), name='f')
+        pdf.close()
+        assert pdf.cache.hits == hits
+
+
+def test_reports_in_one_directory_keep_separate_manifests(tmp_path):
+    a = pyreporter.Report('a', str(tmp_path))
+    a.add_plot(line, widthratio=0.5, args=(1,), name='fa')
+    a.close()
+    b = pyreporter.Report('b', str(tmp_path))
+    b.add_plot(line, widthratio=0.5, args=(2,), name='fb')
+    b.close()
+    figures = tmp_path / 'figures'
+    with open(str(figures / '.pyreporter-cache-a.json')) as f:
+        assert list(json.load(f)) == ['fa.pdf']
+    with open(str(figures / '.pyreporter-cache-b.json')) as f:
+        assert list(json.load(f)) == ['fb.pdf']
+
+
+def test_evict_orphans_only_removes_own_figures(tmp_path):
+    figures = tmp_path / 'figures'
+    a = pyreporter.Report('a', str(tmp_path))
+    a.add_plot(line, widthratio=0.5, args=(1,), name='old')
+    a.add_plot(lambda: line(3), widthratio=0.5, name='shared')
+    a.close()
+    b = pyreporter.Report('b', str(tmp_path))
+    b.add_plot(line, widthratio=0.5, args=(2,), name='other')
+    b.add_plot(lambda: line(3), widthratio=0.5, name='shared')
+    b.close()
+    (figures / 'stray.tmp').write_text('x')
+
+    a = pyreporter.Report('a', str(tmp_path))
+    a.evict_orphans = True
+    a.add_plot(line, widthratio=0.5, args=(1,), name='new')
+    a.close()
+    names = set(os.listdir(str(figures)))
+    assert 'old.pdf' not in names
+    assert {'new.pdf', 'other.pdf', 'shared.pdf', 'stray.tmp'} <= names
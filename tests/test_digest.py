@@ -0,0 +1,68 @@
+import functools
+
+import numpy as np
+
+import pyreporter
+
+DATA = np.arange(5000)
+
+
+def first(v):
+    return v + 1
+
+
+def second(v):
+    return v + 2
+
+
+def uses_data():
+    return DATA.sum()
+
+
+class Opaque(object):
+    pass
+
+
+OPAQUE = Opaque()
+
+
+def uses_opaque():
+    return OPAQUE
+
+
+def test_digest_is_stable():
+    assert pyreporter.code_digest(uses_data) == \
+            pyreporter.code_digest(uses_data)
+    p = functools.partial(first, 1)
+    assert pyreporter.code_digest(p) == pyreporter.code_digest(p)
+
+
+def test_code_of_partial_is_covered():
+    def gen(v):
+        return v + 1
+    before = pyreporter.code_digest(functools.partial(gen, 1))
+    gen.__code__ = second.__code__
+    assert pyreporter.code_digest(functools.partial(gen, 1)) != before
+    assert pyreporter.code_digest(functools.partial(first, 1)) != \
+            pyreporter.code_digest(functools.partial(first, 2))
+
+
+def test_large_arrays_are_covered_by_their_data(monkeypatch):
+    before = pyreporter.code_digest(uses_data)
+    data = DATA.copy()
+    data[2500] = -1
+    monkeypatch.setitem(globals(), 'DATA', data)
+    assert pyreporter.code_digest(uses_data) != before
+
+
+def test_containers_are_covered_by_their_items():
+    def gen(values={'a': np.zeros(5000)}):
+        return values
+    before = pyreporter.code_digest(gen)
+    gen.__defaults__[0]['a'][2500] = 1
+    assert pyreporter.code_digest(gen) != before
+
+
+def test_objects_with_default_repr_always_change():
+    assert pyreporter.code_digest(uses_opaque) != \
+            pyreporter.code_digest(uses_opaque)
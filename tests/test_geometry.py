@@ -0,0 +1,58 @@
+import re
+
+import matplotlib.pyplot as plt
+import pytest
+
+import pyreporter
+
+
+def test_landscape_swaps_the_paper_sides():
+    portrait = pyreporter.PageGeometry('a4paper')
+    landscape = pyreporter.PageGeometry('a4paper', 'landscape')
+    assert landscape.paperwidth == portrait.paperheight
+    assert landscape.paperheight == portrait.paperwidth
+    assert landscape.paperwidth == pyreporter.Length('29.7cm')
+
+
+def test_text_area_is_the_paper_without_margins():
+    geometry = pyreporter.PageGeometry('a4paper', 'landscape', left='1cm',
+            right='2cm', top='3cm', bottom='4cm')
+    assert geometry.textwidth == pyreporter.Length('26.7cm')
+    assert geometry.textheight == pyreporter.Length('14cm')
+    assert geometry.textwidth_in('cm') == pytest.approx(26.7)
+
+
+def test_landscape_report_sizes_plots_by_its_text_area(tmp_path):
+    pdf = pyreporter.Report('report', str(tmp_path), orientation='landscape')
+    assert pdf.get_textwidth_pt() == pytest.approx(
+            pyreporter.Length('25.7cm').get_value_in('pt'))
+    pdf.add_plot(lambda: plt.figure(figsize=(4, 3)), widthratio=0.5,
+            name='f')
+    pdf.close()
+    with open(str(tmp_path / 'report.tex')) as f:
+        tex = f.read()
+    width = re.search(r'\\includegraphics\[width=([0-9.]+)pt\]', tex)
+    assert float(width.group(1)) == pytest.approx(
+            pyreporter.Length('12.85cm').get_value_in('pt'))
+
+
+def test_unknown_orientation():
+    with pytest.raises(Exception, match='orientation'):
+        pyreporter.PageGeometry('a4paper', 'sideways')
+
+
+def test_paper_size_unknown_to_pyreporter(tmp_path):
+    pdf = pyreporter.Report('report', str(tmp_path), pagesize='c5paper')
+    pdf.add_text('Text')
+    with pytest.raises(Exception, match='c5paper'):
+        pdf.get_textwidth_pt()
+    pdf.close()
+    with open(str(tmp_path / 'report.tex')) as f:
+        assert 'c5paper' in f.read()
+
+
+def test_absolute_plot_size_with_unknown_paper_size(tmp_path):
+    pdf = pyreporter.Report('report', str(tmp_path), pagesize='c5paper')
+    pdf.add_plot(lambda: plt.figure(figsize=(4, 3)), width='5cm', name='f')
+    pdf.close()
+    assert (tmp_path / 'figures' / 'f.pdf').exists()
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+import pyreporter
+from conftest import line
+
+class Calls(object):
+    # a global list would be part of the code digest of recorded_line
+    rendered = list()
+
+
+def recorded_line(v):
+    Calls.rendered.append(v)
+    return line(v)
+
+
+class Crash(Exception):
+    pass
+
+
+def run(path, crash_at=None, text='text {}'):
+    """ Adds three sections with a plot each, raises Crash after the plot
+    of section crash_at
+    """
+    del Calls.rendered[:]
+    pdf = pyreporter.Report('report', str(path))
+    pdf.resume = True
+    for i in range(3):
+        pdf.add_section('Section {}'.format(i))
+        pdf.add_text(text.format(i))
+        pdf.add_plot(lambda i=i: recorded_line(i), widthratio=0.5)
+        if i == crash_at:
+            pdf.journal.close()
+            raise Crash()
+    pdf.close()
+    return pdf
+
+
+def journal(path):
+    return str(path / 'report.journal')
+
+
+def test_rerun_resumes_after_the_last_element(tmp_path):
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1)
+    assert Calls.rendered == [0, 1]
+    assert os.path.exists(journal(tmp_path))
+    pdf = run(tmp_path)
+    assert Calls.rendered == [2]
+    assert pdf.journal.verified == 6
+    assert pdf.journal.replayed == 2
+    # the report is complete, the next run starts from scratch
+    assert not os.path.exists(journal(tmp_path))
+    with open(str(tmp_path / 'report.tex')) as f:
+        tex = f.read()
+    assert tex.count(r'\includegraphics') == 3
+
+
+def test_damaged_tail_is_dropped(tmp_path):
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1)
+    with open(journal(tmp_path), 'a') as f:
+        f.write('{"node": 9, "te')
+    j = pyreporter.Journal(journal(tmp_path))
+    j.close()
+    assert len(j.nodes) == 6 and len(j.figures) == 2
+    with open(journal(tmp_path)) as f:
+        assert f.read().endswith('}\n')
+
+
+def test_changed_line_ends_the_journal(tmp_path):
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1)
+    with open(journal(tmp_path)) as f:
+        lines = f.readlines()
+    assert '"text"' in lines[1]
+    lines[1] = lines[1].replace('"text"', '"txt"')
+    with open(journal(tmp_path), 'w') as f:
+        f.writelines(lines)
+    j = pyreporter.Journal(journal(tmp_path))
+    j.close()
+    assert len(j.nodes) == 1 and not j.figures
+
+
+def test_changed_element_truncates_the_journal(tmp_path):
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1)
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1, text='other {}')
+    # the figures are unchanged and reused
+    assert Calls.rendered == []
+    j = pyreporter.Journal(journal(tmp_path))
+    j.close()
+    # the second text differs: the section before it is kept
+    assert j.nodes[0] is not None and len(j.nodes) == 6
+    pdf = run(tmp_path, text='other {}')
+    assert pdf.journal.diverged is None
+    assert pdf.journal.verified == 6
+
+
+def test_changed_figure_is_rendered_again(tmp_path):
+    with pytest.raises(Crash):
+        run(tmp_path, crash_at=1)
+    figures = [n for n in os.listdir(str(tmp_path / 'figures'))
+            if n.endswith('.pdf')]
+    with open(str(tmp_path / 'figures' / sorted(figures)[0]), 'ab') as f:
+        f.write(b'changed')
+    pdf = run(tmp_path)
+    assert len(Calls.rendered) == 2
+    assert pdf.journal.replayed == 1
@@ -0,0 +1,59 @@
+import pickle
+
+import pytest
+
+import pyreporter
+from pyreporter import Length
+
+
+def test_equality_across_units():
+    assert Length('1in') == Length(2.54, 'cm')
+    assert Length('10mm') == Length(1)
+    assert not Length('1cm') == Length('1mm')
+    with pytest.raises(TypeError):
+        Length('1cm') == 1
+
+
+def test_lengths_are_immutable():
+    a = Length('1cm')
+    with pytest.raises(AttributeError):
+        a.value = 2.
+    with pytest.raises(TypeError):
+        hash(a)
+
+
+def test_arithmetic_returns_new_lengths():
+    a = Length('3cm')
+    assert (a * 2).value == 6. and (2 * a).unit == 'cm'
+    assert (a / 2) == Length('1.5cm')
+    assert a.value == 3.
+    with pytest.raises(TypeError):
+        a * a
+
+
+def test_pickling_keeps_value_unit_and_dpi():
+    a = Length('72pt').with_dpi(144.)
+    b = pickle.loads(pickle.dumps(a))
+    assert (b.value, b.unit, b.dpi) == (72., 'pt', 144.)
+    assert b == a
+
+
+def test_from_string():
+    a = Length.from_string(' 12.5 mm ')
+    assert (a.value, a.unit) == (12.5, 'mm')
+    with pytest.raises(Exception, match='unit'):
+        Length.from_string('12 furlong')
+
+
+def test_with_dpi_changes_points_only():
+    a = Length('72pt')
+    assert a.with_dpi(144.).get_value_in('in') == pytest.approx(0.5)
+    assert a.get_value_in('in') == pytest.approx(1.)
+    assert Length('1in').with_dpi(144.).get_value_in('pt') == \
+            pytest.approx(144.)
+
+
+def test_convert_lengths_matches_length():
+    values = pyreporter.convert_lengths([1., 2.5], 'in', 'cm')
+    assert list(values) == pytest.approx(
+            [Length(v, 'in').get_value_in('cm') for v in (1., 2.5)])
@@ -0,0 +1,59 @@
+import os
+
+import pyreporter
+
+
+def concatenate(paths, output):
+    with open(output, 'wb') as f:
+        for path in paths:
+            with open(path, 'rb') as part:
+                f.write(part.read())
+
+
+def make_report(path, rows=1000):
+    pdf = pyreporter.Report('report', str(path), title='Parts')
+    pdf.parts = 2
+    pdf.latex_command = pyreporter.fake_engine_command()
+    pdf.pdf_merger = concatenate
+    for i in range(4):
+        pdf.add_section('Section {}'.format(i))
+        pdf.add_text('Lorem ipsum dolor sit amet. ' * 200)
+        pdf.add_table_stream(([str(j), str(i)] for j in range(rows)),
+                header=['j', 'i'], threshold=100)
+    return pdf
+
+
+def read(path):
+    with open(str(path)) as f:
+        return f.read()
+
+
+def test_parts_with_streamed_tables(tmp_path):
+    result = make_report(tmp_path).close(build=True)
+    assert result['status'] == 'ok'
+    # the start numbers of the second part are only known after a build
+    assert result['rounds'] == 2
+    assert result['merged']
+    assert not os.path.exists(str(tmp_path / 'report.tex'))
+    parts = [read(tmp_path / 'report-part{:02d}.tex'.format(i))
+            for i in (1, 2)]
+    for i, part in enumerate(parts):
+        assert part.count(r'\begin{longtable}') == 2
+        assert part.count(r'\\' + '\n') >= 2 * 1000
+    assert r'\setcounter{section}{2}' in parts[1]
+    assert r'\maketitle' in parts[0] and r'\maketitle' not in parts[1]
+
+
+def test_part_start_numbers_are_kept(tmp_path):
+    make_report(tmp_path).close(build=True)
+    result = make_report(tmp_path).close(build=True)
+    assert result['status'] == 'skipped'
+    assert result['rounds'] == 1
+
+
+def test_build_reports_builds_parts(tmp_path):
+    result = pyreporter.build_reports({'a': make_report(tmp_path / 'a',
+        rows=10)}, processes=1)
+    assert result['failed'] == []
+    assert result['reports']['a']['build']['rounds'] == 2
+    assert os.path.exists(str(tmp_path / 'a' / 'report.pdf'))
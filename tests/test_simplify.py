@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+
+import pyreporter
+
+
+def column_extents(ax):
+    """ The lowest and highest point of the line in every pixel column of the
+    axes, in display coordinates
+    """
+    ax.figure.canvas.draw()
+    line = ax.get_lines()[0]
+    xy = np.column_stack([line.get_xdata(), line.get_ydata()])
+    px = ax.transData.transform(xy)
+    x0, x1 = sorted(ax.bbox.intervalx)
+    visible = (px[:, 0] >= x0) & (px[:, 0] < x1)
+    column = (px[visible, 0] - x0).astype(int)
+    lows = np.full(int(x1 - x0) + 1, np.inf)
+    highs = np.full(int(x1 - x0) + 1, -np.inf)
+    np.minimum.at(lows, column, px[visible, 1])
+    np.maximum.at(highs, column, px[visible, 1])
+    return lows, highs
+
+
+def noisy_line(setup):
+    fig = plt.figure(figsize=(4, 3), dpi=100)
+    ax = fig.add_subplot(111)
+    x = np.linspace(1, 1000, 1000000)
+    y = np.sin(x / 3.) + np.random.RandomState(0).normal(0, 0.3, len(x))
+    ax.plot(x, y, lw=0.5)
+    setup(ax)
+    return fig
+
+
+@pytest.mark.parametrize('setup', [lambda ax: None,
+    lambda ax: ax.set_xlim(500, 510),
+    lambda ax: ax.set_xscale('log'),
+    lambda ax: ax.invert_xaxis()])
+def test_decimated_line_looks_the_same(setup):
+    fig = noisy_line(setup)
+    lows, highs = column_extents(fig.axes[0])
+    stats = pyreporter.simplify_figure(fig, 100000, fig.get_dpi())
+    assert stats['decimated'] == 1
+    assert stats['points_after'] < stats['points_before'] / 50
+    new_lows, new_highs = column_extents(fig.axes[0])
+    # the buckets may be off by a fraction of a pixel at the column edges
+    np.testing.assert_allclose(new_lows[1:-1], lows[1:-1], atol=1.)
+    np.testing.assert_allclose(new_highs[1:-1], highs[1:-1], atol=1.)
+    plt.close(fig)
+
+
+def test_zoomed_line_keeps_the_visible_points():
+    fig = noisy_line(lambda ax: ax.set_xlim(500, 510))
+    pyreporter.simplify_figure(fig, 100000, fig.get_dpi())
+    x = fig.axes[0].get_lines()[0].get_xdata()
+    # about four points per pixel column plus the two next to the view
+    assert (x < 500).sum() == 1 and (x > 510).sum() == 1
+    assert ((x >= 500) & (x <= 510)).sum() > 400
+    plt.close(fig)
+
+
+def test_decimate_line_outside_the_view():
+    x = np.arange(10.)
+    assert list(pyreporter.decimate_line(x, x, 4, (20, 30))) == [9]
+    assert list(pyreporter.decimate_line(x, x, 4, (3.5, 3.7))) == [3, 4]
+
+
+def test_decimate_line_keeps_spikes_next_to_nans():
+    x = np.arange(100000.)
+    y = np.zeros(len(x))
+    y[100::200] = 1.
+    y[7::150] = np.nan
+    idx = pyreporter.decimate_line(x, y, 500)
+    assert (y[idx] == 1.).sum() == 500
+    assert np.isnan(y[idx]).sum() == np.isnan(y).sum()
+
+
+def test_saving_keeps_the_data_of_the_figure(tmp_path):
+    fig = plt.figure(figsize=(4, 3))
+    ax = fig.add_subplot(111)
+    x = np.linspace(0, 1000, 400000)
+    ax.plot(x, np.sin(x))
+    ax.scatter(x, np.cos(x))
+    pdf = pyreporter.Report('report', str(tmp_path))
+    pdf.add_plot(fig, widthratio=0.5, name='f')
+    pdf.close()
+    assert pdf.plot_stats['f']['decimated'] == 1
+    assert len(ax.get_lines()[0].get_xdata()) == len(x)
+    assert not ax.get_lines()[0].get_rasterized()
+    assert not ax.collections[0].get_rasterized()
+    plt.close(fig)
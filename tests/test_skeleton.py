@@ -0,0 +1,34 @@
+import pytest
+
+import pyreporter
+
+
+def title(params):
+    return 'Report {}'.format(params['n'])
+
+
+def rows(params):
+    return [[str(k), str(k * params['n'])] for k in range(3)]
+
+
+def make_skeleton(**kwargs):
+    skeleton = pyreporter.Skeleton(**kwargs)
+    skeleton.attributes['latex_command'] = pyreporter.fake_engine_command()
+    skeleton.add_section('Numbers')
+    skeleton.add_table_slot(rows, header=['k', 'v'])
+    return skeleton
+
+
+def test_build_reports_from_a_skeleton(tmp_path):
+    result = make_skeleton(title=title).build([dict(n=1), dict(n=2)],
+            str(tmp_path), processes=2)
+    assert result['failed'] == []
+    with open(str(tmp_path / '1' / 'report.tex')) as f:
+        tex = f.read()
+    assert 'Report 2' in tex and '2 & 4' in tex
+
+
+def test_build_refuses_a_skeleton_with_lambdas(tmp_path):
+    skeleton = make_skeleton(title=lambda params: str(params['n']))
+    with pytest.raises(Exception, match='module level functions'):
+        skeleton.build([dict(n=1)], str(tmp_path))
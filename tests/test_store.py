@@ -0,0 +1,56 @@
+import os
+
+import pyreporter
+from conftest import bar, line
+
+
+def report(path, store, v):
+    pdf = pyreporter.Report('report', str(path))
+    pdf.store = store
+    pdf.add_plot(line, widthratio=0.5, args=(v,), name='f')
+    pdf.close()
+    return pdf
+
+
+def read(path):
+    with open(str(path), 'rb') as f:
+        return f.read()
+
+
+def test_figure_is_fetched_from_the_store(tmp_path):
+    store = pyreporter.FigureStore(str(tmp_path / 'store'))
+    report(tmp_path / 'a', store, 1)
+    b = report(tmp_path / 'b', store, 1)
+    assert store.hits == 1
+    assert b.plot_stats == {}
+    assert read(tmp_path / 'a' / 'figures' / 'f.pdf') == \
+            read(tmp_path / 'b' / 'figures' / 'f.pdf')
+
+
+def test_rendering_a_fetched_figure_keeps_the_store(tmp_path):
+    store = pyreporter.FigureStore(str(tmp_path / 'store'))
+    report(tmp_path / 'a', store, 1)
+    a_file = tmp_path / 'a' / 'figures' / 'f.pdf'
+    stored = [os.path.join(store.directory, n)
+            for n in os.listdir(store.directory)]
+    assert len(stored) == 1
+    before = read(a_file)
+    report(tmp_path / 'b', store, 1)
+    report(tmp_path / 'b', store, 2)
+    assert read(tmp_path / 'b' / 'figures' / 'f.pdf') != before
+    assert read(a_file) == before
+    assert read(stored[0]) == before
+    assert not [n for n in os.listdir(str(tmp_path / 'b' / 'figures'))
+            if n.endswith('.tmp')]
+
+
+def test_generators_with_the_same_arguments_are_not_shared(tmp_path):
+    store = pyreporter.FigureStore(str(tmp_path / 'store'))
+    pdf = pyreporter.Report('report', str(tmp_path / 'a'))
+    pdf.store = store
+    pdf.add_plot(line, widthratio=0.5, args=(1,), name='a')
+    pdf.add_plot(bar, widthratio=0.5, args=(1,), name='b')
+    pdf.close()
+    assert store.hits == 0
+    figures = tmp_path / 'a' / 'figures'
+    assert read(figures / 'a.pdf') != read(figures / 'b.pdf')
@@ -0,0 +1,96 @@
+import io
+
+import numpy as np
+import pytest
+
+import pyreporter
+
+
+def stream_tex(rows, **kwargs):
+    f = io.StringIO()
+    pyreporter.TableStream(rows, **kwargs).write(f)
+    return f.getvalue()
+
+
+def test_make_table_without_rows():
+    tex = pyreporter.make_table([], header=['a', 'b'])
+    assert r'\begin{tabular}{ll}' in tex
+    assert r'a & b\\' in tex
+
+
+@pytest.mark.parametrize('kwargs, cols', [
+    (dict(header=['a', 'b', 'c']), 'lll'),
+    (dict(cols='rr'), 'rr')])
+def test_empty_stream_is_sized_by_header_or_cols(kwargs, cols):
+    tex = stream_tex(iter([]), **kwargs)
+    assert r'\begin{tabular}{%s}' % cols in tex
+    assert r'\bottomrule' in tex
+
+
+def test_empty_stream_without_width_writes_nothing():
+    assert stream_tex(iter([])) == ''
+
+
+def test_stream_below_threshold_is_a_tabular():
+    rows = [[str(i), str(i*i)] for i in range(5)]
+    tex = stream_tex(iter(rows), header=['i', 'i^2'], threshold=5)
+    assert tex == pyreporter.make_table(rows, header=['i', 'i^2'])
+
+
+def test_stream_above_threshold_is_a_longtable():
+    rows = [[str(i), str(i*i)] for i in range(25)]
+    tex = stream_tex(iter(rows), header=['i', 'i^2'], threshold=5,
+            chunksize=7)
+    assert r'\begin{longtable}{ll}' in tex
+    assert 'tabular' not in tex
+    for i, j in rows:
+        assert r'  {} & {}\\'.format(i, j) in tex
+    assert tex.count(r'\\' + '\n') == 25 + 2
+
+
+def test_table_keeps_the_rows_it_was_added_with(tmp_path):
+    pdf = pyreporter.Report('report', str(tmp_path))
+    rows = [['1', '2']]
+    pdf.add_table(rows)
+    rows.clear()
+    rows.append(['X', 'Y'])
+    pdf.close()
+    with open(str(tmp_path / 'report.tex')) as f:
+        tex = f.read()
+    assert '1 & 2' in tex and 'X & Y' not in tex
+
+
+ROWS = [['1', '2.5'], ['3', '4.25']]
+
+
+def test_array_is_written_like_a_list_of_strings():
+    assert pyreporter.make_table(np.array([[1, 2.5], [3, 4.25]]),
+            formats=['%d', None]) == pyreporter.make_table(ROWS)
+    assert pyreporter.make_table(np.array(ROWS)) == \
+            pyreporter.make_table(ROWS)
+
+
+def test_dataframe_is_written_with_its_column_names():
+    pandas = pytest.importorskip('pandas')
+    frame = pandas.DataFrame({'a': [1, 3], 'b': [2.5, 4.25]})
+    assert pyreporter.make_table(frame) == \
+            pyreporter.make_table(ROWS, header=['a', 'b'])
+    assert pyreporter.make_table(frame, header=['x', 'y']) == \
+            pyreporter.make_table(ROWS, header=['x', 'y'])
+
+
+@pytest.mark.parametrize('formats', ['%.2f', '{:.2f}',
+    '{:.2f}'.format, ['%.2f', '{:.2f}']])
+def test_formats(formats):
+    tex = pyreporter.make_table([[1, 2.5], [3, 4.25]], formats=formats)
+    assert tex == pyreporter.make_table([['1.00', '2.50'], ['3.00', '4.25']])
+
+
+def test_formats_have_to_match_the_columns():
+    with pytest.raises(Exception, match='2 formats for 3 columns'):
+        pyreporter.make_table([[1, 2, 3]], formats=['%d', '%d'])
+
+
+def test_table_data_has_to_be_2d():
+    with pytest.raises(Exception, match='2 dimensional'):
+        pyreporter.make_table(np.arange(3))
@@ -0,0 +1,40 @@
+import json
+
+import matplotlib.pyplot as plt
+
+import pyreporter
+
+
+def line():
+    fig = plt.figure(figsize=(4, 3))
+    plt.plot([0, 1])
+    return fig
+
+
+def run(path, watch_file):
+    pdf = pyreporter.Report('report', str(path))
+    pdf.force_all = True
+    if watch_file is not None:
+        assert pdf.watch_file == watch_file
+    else:
+        pdf.watch_file = None
+    pdf.add_plot(line, widthratio=0.5, name='f', depends=[__file__])
+    pdf.close()
+    return pdf
+
+
+def test_watch_mode_is_read_once_from_the_environment(tmp_path, monkeypatch):
+    deps = str(tmp_path / 'deps.json')
+    monkeypatch.setenv('PYREPORTER_WATCH', deps)
+    run(tmp_path, deps)
+    # force_all is ignored in watch mode
+    assert run(tmp_path, deps).cache.hits == 1
+    with open(deps) as f:
+        assert json.loads(f.readline()) == [__file__]
+
+
+def test_watch_mode_can_be_turned_off(tmp_path, monkeypatch):
+    monkeypatch.setenv('PYREPORTER_WATCH', str(tmp_path / 'deps.json'))
+    run(tmp_path, None)
+    assert run(tmp_path, None).plot_stats != {}
+    assert not (tmp_path / 'deps.json').exists()